@@ -0,0 +1,53 @@
+"""
+Правка вариантов ответа диффом вместо «удалить всё и вставить заново».
+
+Изменённые строки обновляются на месте, новые — вставляются, удаляются
+только убранные. ID вариантов сохраняются, поэтому UserAnswer.answer_id
+прошлых попыток остаются валидными, а правка опечатки — это один UPDATE.
+"""
+from sqlalchemy import select
+
+from models import Answer, UserAnswer
+
+
+class AnswerInUseError(Exception):
+    """Удаляемые варианты уже выбирали в попытках — удалить их нельзя, не сломав результаты."""
+
+    def __init__(self, texts):
+        super().__init__(', '.join(texts))
+        self.texts = texts
+
+
+def apply_answer_diff(db, question, desired) -> bool:
+    """
+    desired — [(answer_id | None, text, score, is_correct), ...] в нужном порядке.
+    answer_id сопоставляет строку с существующим вариантом вопроса; None — новый вариант.
+    Изменения остаются в сессии (коммит — на вызывающей стороне). Возвращает True, если что-то изменилось.
+    """
+    existing = {a.id: a for a in question.answers}
+    kept = set()
+    changed = False
+    for answer_id, text, score, is_correct in desired:
+        a = existing.get(answer_id)
+        if a is None or answer_id in kept:
+            question.answers.append(Answer(text=text, score=score, is_correct=is_correct))
+            changed = True
+            continue
+        kept.add(answer_id)
+        if (a.text, a.score, bool(a.is_correct)) != (text, score, is_correct):
+            a.text, a.score, a.is_correct = text, score, is_correct
+            changed = True
+
+    removed = [a for aid, a in existing.items() if aid not in kept]
+    if removed:
+        in_use = set(db.execute(
+            select(UserAnswer.answer_id)
+            .where(UserAnswer.answer_id.in_([a.id for a in removed]))
+            .distinct()
+        ).scalars())
+        if in_use:
+            raise AnswerInUseError([a.text for a in removed if a.id in in_use])
+        for a in removed:
+            question.answers.remove(a)  # delete-orphan удалит строку при flush
+        changed = True
+    return changed
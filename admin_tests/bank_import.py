@@ -0,0 +1,258 @@
+"""
+Массовый импорт банка вопросов (CSV / JSON / XLSX).
+
+Файл сначала целиком разбирается и проверяется (ошибки — построчно),
+и только если ошибок нет, все вопросы и варианты вставляются
+несколькими пакетными INSERT в одной транзакции.
+
+Формат CSV/XLSX повторяет форму добавления вопроса — первая строка заголовок:
+    question, correct, ans_1, score_1, ans_2, score_2, ... ans_8, score_8
+correct — номер правильного варианта (1..N). Необязательные столбцы
+topic и weight — тема и вес вопроса для выборки билета (см. sampling.py).
+
+Формат JSON:
+    [{"question": "...", "topic": "...", "weight": 1,
+      "answers": [{"text": "...", "score": 1, "correct": true}, ...]}, ...]
+
+Режимы:
+    append — все вопросы добавляются как новые;
+    upsert — у вопроса с тем же текстом варианты правятся диффом (совпавшие по тексту
+             обновляются на месте, новые добавляются, убранные удаляются),
+             новые вопросы добавляются, остальные вопросы теста не трогаются.
+"""
+import csv
+import io
+import json
+import math
+from dataclasses import dataclass
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import selectinload
+
+from admin_tests.answer_diff import apply_answer_diff
+from admin_tests.xlsx import read_xlsx_rows, READ_ERRORS
+from models import Question, Answer
+
+MAX_ANSWERS = 8
+MIN_ANSWERS = 2
+QUESTION_MAX_LEN = 500
+ANSWER_MAX_LEN = 255
+TOPIC_MAX_LEN = 100
+INSERT_BATCH = 1000
+
+
+@dataclass
+class ParsedQuestion:
+    row: int
+    text: str
+    answers: list  # [(text, score, is_correct), ...]
+    topic: str = None
+    weight: float = 1.0
+
+
+class BankFormatError(ValueError):
+    """Файл не удалось разобрать целиком (формат, кодировка, заголовок)."""
+
+
+def _cell(v) -> str:
+    return '' if v is None else str(v).strip()
+
+
+def _score(v, errors, row, i):
+    raw = _cell(v).replace(',', '.')
+    if not raw:
+        return 0.0
+    try:
+        score = float(raw)
+    except ValueError:
+        score = math.nan
+    if not math.isfinite(score):  # nan/inf испортили бы Test.max_score и проценты
+        errors.append(f'Строка {row}: балл варианта {i} — не число ({raw!r})')
+        return 0.0
+    return score
+
+
+def _weight(v, errors, row):
+    raw = _cell(v).replace(',', '.')
+    if not raw:
+        return 1.0
+    try:
+        weight = float(raw)
+    except ValueError:
+        weight = -1.0
+    if not math.isfinite(weight) or weight < 0:
+        errors.append(f'Строка {row}: weight — не неотрицательное число ({raw!r})')
+        return 1.0
+    return weight
+
+
+def _from_table(rows):
+    """Строки CSV/XLSX (с заголовком) -> (questions, errors)."""
+    rows = iter(rows)
+    try:
+        header = [_cell(h).lower() for h in next(rows)]
+    except StopIteration:
+        raise BankFormatError('Файл пуст')
+    if 'question' not in header:
+        raise BankFormatError('В заголовке нет столбца question')
+    col = {name: i for i, name in enumerate(header)}
+
+    def get(r, name):
+        i = col.get(name)
+        return r[i] if i is not None and i < len(r) else None
+
+    questions, errors = [], []
+    for row_no, r in enumerate(rows, start=2):
+        if not any(_cell(v) for v in r):
+            continue
+        text = _cell(get(r, 'question'))
+        answers = []
+        for i in range(1, MAX_ANSWERS + 1):
+            ans = _cell(get(r, f'ans_{i}'))
+            if ans:
+                answers.append((ans, _score(get(r, f'score_{i}'), errors, row_no, i), False))
+        correct = _cell(get(r, 'correct'))
+        try:
+            correct = int(float(correct)) if correct else 1
+        except (ValueError, OverflowError):  # OverflowError — int(inf)
+            errors.append(f'Строка {row_no}: correct — не номер варианта ({correct!r})')
+            correct = 0
+        if 1 <= correct <= len(answers):
+            a_text, a_score, _ = answers[correct - 1]
+            answers[correct - 1] = (a_text, a_score, True)
+        elif answers and correct:
+            errors.append(f'Строка {row_no}: correct={correct}, а вариантов {len(answers)}')
+        questions.append(ParsedQuestion(
+            row=row_no, text=text, answers=answers,
+            topic=_cell(get(r, 'topic')) or None,
+            weight=_weight(get(r, 'weight'), errors, row_no),
+        ))
+    return questions, errors
+
+
+def _from_json(data):
+    if not isinstance(data, list):
+        raise BankFormatError('JSON должен быть списком вопросов')
+    questions, errors = [], []
+    for n, item in enumerate(data, start=1):
+        if not isinstance(item, dict):
+            errors.append(f'Элемент {n}: ожидается объект')
+            continue
+        answers = []
+        for i, a in enumerate(item.get('answers') or [], start=1):
+            if not isinstance(a, dict):
+                errors.append(f'Элемент {n}: вариант {i} — ожидается объект')
+                continue
+            answers.append((_cell(a.get('text')), _score(a.get('score'), errors, n, i), bool(a.get('correct'))))
+        questions.append(ParsedQuestion(
+            row=n, text=_cell(item.get('question')), answers=answers,
+            topic=_cell(item.get('topic')) or None,
+            weight=_weight(item.get('weight'), errors, n),
+        ))
+    return questions, errors
+
+
+def parse_bank(filename: str, data: bytes, mode: str = 'append'):
+    """Разбор файла по расширению -> (questions, errors). Ошибки формата — BankFormatError."""
+    name = (filename or '').lower()
+    try:
+        if name.endswith('.xlsx'):
+            questions, errors = _from_table(read_xlsx_rows(io.BytesIO(data)))
+        elif name.endswith('.json'):
+            questions, errors = _from_json(json.loads(data.decode('utf-8-sig')))
+        elif name.endswith('.csv'):
+            text = data.decode('utf-8-sig')
+            try:
+                dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            questions, errors = _from_table(csv.reader(io.StringIO(text, newline=''), dialect))
+        else:
+            raise BankFormatError('Поддерживаются файлы .csv, .json и .xlsx')
+    except BankFormatError:
+        raise
+    except (UnicodeDecodeError, *READ_ERRORS) as e:
+        raise BankFormatError(f'Не удалось прочитать файл: {e}')
+    return questions, errors + validate(questions, mode)
+
+
+def validate(questions, mode: str = 'append') -> list:
+    errors = []
+    seen = {}
+    for q in questions:
+        where = f'Строка {q.row}'
+        if not q.text:
+            errors.append(f'{where}: пустой текст вопроса')
+        elif len(q.text) > QUESTION_MAX_LEN:
+            errors.append(f'{where}: вопрос длиннее {QUESTION_MAX_LEN} символов')
+        if q.topic and len(q.topic) > TOPIC_MAX_LEN:
+            errors.append(f'{where}: тема длиннее {TOPIC_MAX_LEN} символов')
+        if len(q.answers) < MIN_ANSWERS:
+            errors.append(f'{where}: нужно минимум {MIN_ANSWERS} варианта')
+        if len(q.answers) > MAX_ANSWERS:
+            errors.append(f'{where}: больше {MAX_ANSWERS} вариантов')
+        for i, (text, _, _) in enumerate(q.answers, start=1):
+            if not text:
+                errors.append(f'{where}: пустой вариант {i}')
+            elif len(text) > ANSWER_MAX_LEN:
+                errors.append(f'{where}: вариант {i} длиннее {ANSWER_MAX_LEN} символов')
+        if mode == 'upsert' and q.text:
+            if q.text in seen:
+                errors.append(f'{where}: вопрос повторяет строку {seen[q.text]} (в режиме замены тексты должны быть уникальны)')
+            seen.setdefault(q.text, q.row)
+    return errors
+
+
+def _batches(items, size=INSERT_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def import_bank(db, test_id: int, questions, mode: str = 'append') -> dict:
+    """
+    Пакетная вставка уже проверенных вопросов. Коммит — на вызывающей стороне.
+    Возвращает счётчики {'added': n, 'updated': m}.
+    В режиме upsert может бросить AnswerInUseError (убранные варианты уже выбирали в попытках).
+    """
+    existing = {}
+    if mode == 'upsert':
+        existing = {
+            text: qid for qid, text in db.execute(
+                select(Question.id, Question.text).where(Question.test_id == test_id)
+            ).all()
+        }
+
+    to_add = [q for q in questions if q.text not in existing]
+    to_update = [q for q in questions if q.text in existing]
+
+    answer_rows = []
+    for batch in _batches(to_add):
+        ids = db.execute(
+            insert(Question).returning(Question.id, sort_by_parameter_order=True),
+            [{'test_id': test_id, 'text': q.text, 'topic': q.topic, 'weight': q.weight} for q in batch],
+        ).scalars().all()
+        for qid, q in zip(ids, batch):
+            answer_rows += [
+                {'question_id': qid, 'text': t, 'score': s, 'is_correct': c} for t, s, c in q.answers
+            ]
+
+    if to_update:
+        # существующие вопросы правим диффом по тексту варианта: ID ответов и прошлые попытки сохраняются
+        updated_ids = [existing[q.text] for q in to_update]
+        loaded = {}
+        for batch in _batches(updated_ids):
+            for question in db.query(Question).options(selectinload(Question.answers))\
+                    .filter(Question.id.in_(batch)).all():
+                loaded[question.id] = question
+        for q in to_update:
+            question = loaded[existing[q.text]]
+            question.topic, question.weight = q.topic, q.weight
+            ids_by_text = {a.text: a.id for a in question.answers}
+            apply_answer_diff(db, question, [
+                (ids_by_text.get(t), t, s, c) for t, s, c in q.answers
+            ])
+
+    for batch in _batches(answer_rows):
+        db.execute(insert(Answer), batch)
+
+    return {'added': len(to_add), 'updated': len(to_update)}
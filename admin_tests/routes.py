@@ -1,8 +1,20 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, abort
-from db import SessionLocal
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, abort, Response
+from db import get_db, get_report_db, report_sessionmaker
 from models import *
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
+from sqlalchemy import func, tuple_, select, delete
+import csv
+import datetime
+import io
+import math
+from admin_tests.answer_diff import apply_answer_diff, AnswerInUseError
+from admin_tests.bank_import import parse_bank, import_bank, BankFormatError
+from admin_tests.xlsx import iter_xlsx
+from papers import bump_test_version, drop_compiled_test, get_compiled_test, catalog_versions
+import http_cache
+from attempts import forget
+import archive
+import autosave
 
 tests_bp = Blueprint('tests', __name__, url_prefix='/tests')
 
@@ -21,14 +33,42 @@ def _pos_int_or_none(v, *, max_value=None):
         n = min(n, max_value)
     return n
 
+
+def _scores_valid(form, answer_count: int) -> bool:
+    """Баллы вариантов формы — конечные числа (nan/inf испортили бы Test.max_score)."""
+    for i in range(1, answer_count + 1):
+        try:
+            if not math.isfinite(float(form.get(f'score_{i}', 0))):
+                return False
+        except ValueError:
+            return False
+    return True
+
+
+def _topic_and_weight(form):
+    """Тема (пусто -> None) и вес вопроса (не число, inf/nan, < 0 -> 1.0) из формы."""
+    topic = (form.get('topic') or '').strip()[:100] or None
+    try:
+        weight = float((form.get('weight') or '1').replace(',', '.'))
+    except ValueError:
+        weight = 1.0
+    return topic, weight if math.isfinite(weight) and weight >= 0 else 1.0
+
 @tests_bp.route('/')
 def list_tests():
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
-    tests = db.query(Test).all()
-    db.close()
-    return render_template('tests/list.html', tests=tests)
+    db = get_db()
+    catalog = catalog_versions(db)
+    etag = http_cache.make_etag('tests.list_tests', catalog)
+    cached = http_cache.not_modified(etag)
+    if cached:
+        return cached
+    cards = http_cache.fragment(
+        ('tests/_cards', None, catalog),
+        lambda: render_template('tests/_cards.html', tests=db.query(Test).order_by(Test.id).all()),
+    )
+    return http_cache.with_validators(render_template('tests/list.html', cards=cards), etag)
 
 # create_test
 @tests_bp.route('/create', methods=['GET', 'POST'])
@@ -45,7 +85,7 @@ def create_test():
         qpa = request.form.get('questions_per_attempt')
         questions_per_attempt = int(qpa) if qpa and qpa.strip() and int(qpa) > 0 else None
 
-        db = SessionLocal()
+        db = get_db()
         test = Test(
             title=title,
             description=description,
@@ -55,7 +95,6 @@ def create_test():
         db.add(test)
         db.commit()
         test_id = test.id
-        db.close()
         return redirect(url_for('tests.view_test', test_id=test_id))
     return render_template('tests/create.html')
 
@@ -64,18 +103,26 @@ def create_test():
 def view_test(test_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
-    test = db.query(Test)\
-        .options(joinedload(Test.questions).joinedload(Question.answers))\
-        .filter_by(id=test_id).first()
-    db.close()
-    return render_template('tests/view.html', test=test)
+    db = get_db()
+    # снимок теста из кэша воркера: при неизменной версии — один узкий запрос
+    test = get_compiled_test(db, test_id)
+    if not test:
+        abort(404)
+    etag = http_cache.make_etag('tests.view_test', test.id, test.version)
+    cached = http_cache.not_modified(etag)
+    if cached:
+        return cached
+    questions = http_cache.fragment(
+        ('tests/_questions', test.id, test.version),
+        lambda: render_template('tests/_questions.html', test=test),
+    )
+    return http_cache.with_validators(render_template('tests/view.html', test=test, questions=questions), etag)
 
 @tests_bp.route('/<int:test_id>/add_question', methods=['GET', 'POST'])
 def add_question(test_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
+    db = get_db()
     test = db.query(Test).filter_by(id=test_id).first()
     if request.method == 'POST':
         q_text = request.form['text']
@@ -88,9 +135,12 @@ def add_question(test_id):
                 break
         if answer_count < 2:
             flash('Добавьте минимум два варианта!')
-            db.close()
             return render_template('tests/add_question.html', test=test)
-        q = Question(text=q_text, test_id=test.id)
+        if not _scores_valid(request.form, answer_count):
+            flash('Баллы вариантов должны быть числами')
+            return render_template('tests/add_question.html', test=test)
+        topic, weight = _topic_and_weight(request.form)
+        q = Question(text=q_text, test_id=test.id, topic=topic, weight=weight)
         db.add(q)
         db.commit()
         correct = int(request.form['correct'])
@@ -102,33 +152,110 @@ def add_question(test_id):
             is_corr = (i == correct)
             answers.append(Answer(text=ans_text, is_correct=is_corr, score=score, question=q))
         db.add_all(answers)
+        bump_test_version(db, test.id)
         db.commit()
         test_id_val = test.id  # Сохраняем id
-        db.close()
         return redirect(url_for('tests.view_test', test_id=test_id_val))
-    db.close()
     return render_template('tests/add_question.html', test=test)
 
+IMPORT_MAX_ERRORS_SHOWN = 200
+
+
+@tests_bp.route('/<int:test_id>/import', methods=['GET', 'POST'])
+def import_questions(test_id):
+    """Массовая загрузка вопросов из CSV/JSON/XLSX (см. admin_tests/bank_import.py)."""
+    if not is_admin():
+        return redirect(url_for('auth.login'))
+    db = get_db()
+    test = db.query(Test).filter_by(id=test_id).first()
+    if not test:
+        abort(404)
+    if request.method == 'GET':
+        return render_template('tests/import_questions.html', test=test, errors=[])
+
+    mode = request.form.get('mode', 'append')
+    if mode not in ('append', 'upsert'):
+        mode = 'append'
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Выберите файл для загрузки')
+        return render_template('tests/import_questions.html', test=test, errors=[])
+
+    try:
+        questions, errors = parse_bank(upload.filename, upload.read(), mode)
+    except BankFormatError as e:
+        return render_template('tests/import_questions.html', test=test, errors=[str(e)])
+    if errors:
+        return render_template(
+            'tests/import_questions.html',
+            test=test,
+            errors=errors[:IMPORT_MAX_ERRORS_SHOWN],
+            errors_total=len(errors),
+        )
+    if not questions:
+        flash('В файле нет вопросов')
+        return render_template('tests/import_questions.html', test=test, errors=[])
+
+    try:
+        counts = import_bank(db, test.id, questions, mode)
+    except AnswerInUseError as e:
+        db.rollback()
+        return render_template('tests/import_questions.html', test=test, errors=[
+            f'Нельзя удалить варианты, которые уже выбирали в попытках: {e}'
+        ])
+    bump_test_version(db, test.id)
+    db.commit()
+    flash(f"Импорт завершён: добавлено {counts['added']}, обновлено {counts['updated']}", 'success')
+    return redirect(url_for('tests.view_test', test_id=test.id))
+
+
 @tests_bp.route('/<int:test_id>/delete', methods=['POST'])
 def delete_test(test_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
-    test = db.query(Test).filter_by(id=test_id).first()
-    if test:
-        db.delete(test)
+    db = get_db()
+    if _delete_test_rows(db, test_id):
         db.commit()
-    db.close()
+        drop_compiled_test(test_id)
     flash('Тест удалён', 'success')
     return redirect(url_for('tests.list_tests'))
 
+def _delete_test_rows(db, test_id: int) -> bool:
+    """
+    Удаляет тест со всем зависимым пакетными DELETE по test_id.
+    ORM-каскад (db.delete(test)) грузил вопросы, затем варианты каждого вопроса
+    и ответы каждой попытки — число запросов росло с размером банка.
+    """
+    results = select(TestResult.id).where(TestResult.test_id == test_id)
+    questions = select(Question.id).where(Question.test_id == test_id)
+    # билеты открытых попыток лежат в кэше воркера — их надо забыть
+    open_ids = db.execute(results.where(TestResult.passed_at.is_(None))).scalars().all()
+
+    for stmt in (
+        delete(UserAnswer).where(UserAnswer.result_id.in_(results)),
+        delete(AttemptState).where(AttemptState.result_id.in_(results)),
+        delete(AttemptArchive).where(AttemptArchive.result_id.in_(results)),
+        delete(UserTestSummary).where(UserTestSummary.test_id == test_id),
+        delete(TestResult).where(TestResult.test_id == test_id),
+        delete(Answer).where(Answer.question_id.in_(questions)),
+        delete(Question).where(Question.test_id == test_id),
+    ):
+        db.execute(stmt.execution_options(synchronize_session=False))
+    deleted = db.execute(
+        delete(Test).where(Test.id == test_id).execution_options(synchronize_session=False)
+    ).rowcount
+    for rid in open_ids:
+        autosave.discard(rid)
+        forget(rid)
+    return bool(deleted)
+
 # edit_test
 @tests_bp.route('/<int:test_id>/edit', methods=['GET', 'POST'])
 def edit_test(test_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
 
-    db = SessionLocal()
+    db = get_db()
     try:
         # Берём тест (без questions, чтобы не детачить ленивые связи)
         test = db.query(Test).filter_by(id=test_id).first()
@@ -158,6 +285,7 @@ def edit_test(test_id):
                     qpa_val = None
             test.questions_per_attempt = qpa_val
 
+            bump_test_version(db, test.id)
             db.commit()
             flash('Тест обновлён', 'success')
             return redirect(url_for('tests.view_test', test_id=test.id))
@@ -171,8 +299,6 @@ def edit_test(test_id):
         # Можно залогировать e, если используешь логгер
         flash('Не удалось сохранить изменения. Проверьте введённые данные.', 'error')
         return redirect(url_for('tests.edit_test', test_id=test_id))
-    finally:
-        db.close()
 
 
 
@@ -180,13 +306,13 @@ def edit_test(test_id):
 def delete_question(question_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
+    db = get_db()
     q = db.query(Question).filter_by(id=question_id).first()
     test_id = q.test_id if q else None
     if q:
         db.delete(q)
+        bump_test_version(db, test_id)
         db.commit()
-    db.close()
     flash('Вопрос удалён', 'success')
     return redirect(url_for('tests.view_test', test_id=test_id))
 
@@ -194,19 +320,13 @@ def delete_question(question_id):
 def edit_question(question_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
+    db = get_db()
     q = db.query(Question)\
         .options(joinedload(Question.answers), joinedload(Question.test))\
         .filter_by(id=question_id).first()
     if not q:
-        db.close()
         return redirect(url_for('tests.list_tests'))
     if request.method == 'POST':
-        q.text = request.form['text']
-        for a in q.answers:
-            db.delete(a)
-        db.commit()
-        answers = []
         correct = int(request.form['correct'])
         answer_count = 0
         while True:
@@ -214,69 +334,276 @@ def edit_question(question_id):
             if not request.form.get(f'ans_{answer_count}'):
                 answer_count -= 1
                 break
-        for i in range(1, answer_count+1):
+        if answer_count < 2:
+            flash('Добавьте минимум два варианта!')
+            return render_template('tests/edit_question.html', question=q)
+        if not _scores_valid(request.form, answer_count):
+            flash('Баллы вариантов должны быть числами')
+            return render_template('tests/edit_question.html', question=q)
+
+        # Желаемое состояние вариантов; ans_id_N связывает строку формы с существующим ответом
+        desired = []
+        for i in range(1, answer_count + 1):
             ans_text = request.form.get(f'ans_{i}')
             if not ans_text:
                 continue
             score = float(request.form.get(f'score_{i}', 0))
-            is_corr = (i == correct)
-            answers.append(Answer(text=ans_text, is_correct=is_corr, score=score, question=q))
-        db.add_all(answers)
-        db.commit()
-        test_id = q.test_id
-        db.close()
+            answer_id = _pos_int_or_none(request.form.get(f'ans_id_{i}'))
+            desired.append((answer_id, ans_text, score, i == correct))
+
+        new_text = request.form['text']
+        topic, weight = _topic_and_weight(request.form)
+        changed = (q.text, q.topic, q.weight) != (new_text, topic, weight)
+        q.text, q.topic, q.weight = new_text, topic, weight
+        try:
+            changed = apply_answer_diff(db, q, desired) or changed
+        except AnswerInUseError as e:
+            db.rollback()
+            flash(f'Нельзя удалить варианты, которые уже выбирали в попытках: {e}')
+            return redirect(url_for('tests.edit_question', question_id=question_id))
+        if changed:
+            bump_test_version(db, q.test_id)
+            db.commit()
         flash('Вопрос обновлён', 'success')
-        return redirect(url_for('tests.view_test', test_id=test_id))
-    db.close()
+        return redirect(url_for('tests.view_test', test_id=q.test_id))
     return render_template('tests/edit_question.html', question=q)
 
+RESULTS_PAGE_SIZE = 50
+PASS_THRESHOLD = 0.7  # «сдал» — от 70% максимума (как на шаблонах)
+
+
+def _parse_date(v):
+    try:
+        return datetime.datetime.strptime((v or '').strip(), '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _parse_cursor(raw, sort):
+    """Курсор keyset-пагинации «значение~id» последней строки предыдущей страницы."""
+    try:
+        value, last_id = (raw or '').rsplit('~', 1)
+        last_id = int(last_id)
+        value = float(value) if sort == 'score' else datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return value, last_id
+
+
 @tests_bp.route('/<int:test_id>/results')
 def test_results(test_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
 
-    db = SessionLocal()
+    db = get_report_db()
     test = db.query(Test).filter_by(id=test_id).first()
+    if not test:
+        abort(404)
 
-    # Получаем результаты с join-ами
-    results = db.query(TestResult)\
-        .options(
-            joinedload(TestResult.user),
-            joinedload(TestResult.test)
-        )\
-        .filter_by(test_id=test_id).order_by(TestResult.score.desc()).all()
+    # Сводка — одним агрегатным запросом, без выгрузки строк в Python.
+    # Незавершённые попытки (идут сейчас) в результаты не попадают.
+    total, avg_score, min_score, best_score = db.query(
+        func.count(TestResult.id),
+        func.avg(TestResult.score),
+        func.min(TestResult.score),
+        func.max(TestResult.score),
+    ).filter(TestResult.test_id == test_id, TestResult.passed_at.isnot(None)).one()
 
-    # Максимальный балл (можно хранить в тесте, либо считать по вопросам)
-    if hasattr(test, 'max_score') and test.max_score:
-        max_score = test.max_score
-    else:
-        # Если max_score не задан, возьмём максимальный из результатов, fallback=0
-        max_score = max([r.score for r in results], default=0)
+    # Максимальный балл хранится в тесте; если вопросов нет — берём лучший результат
+    max_score = test.max_score or best_score or 0
+    avg_score = round(avg_score or 0, 2)
+    min_score = min_score or 0
+
+    # Параметры таблицы: сортировка, фильтры, курсор
+    sort = request.args.get('sort', 'score')
+    if sort not in ('score', 'date'):
+        sort = 'score'
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        order = 'desc'
+    status = request.args.get('status', '')
+    date_from = _parse_date(request.args.get('from'))
+    date_to = _parse_date(request.args.get('to'))
+    cursor = _parse_cursor(request.args.get('after'), sort)
 
-    # Средний балл
-    if results:
-        avg_score = round(sum(r.score for r in results) / len(results), 2)
-        min_score = min(r.score for r in results)
+    sort_col = TestResult.score if sort == 'score' else TestResult.started_at
+    q = db.query(
+        TestResult.id,
+        TestResult.score,
+        TestResult.started_at,
+        TestResult.passed_at,
+        User.fio,
+    ).join(User, User.id == TestResult.user_id)\
+     .filter(TestResult.test_id == test_id, TestResult.passed_at.isnot(None))
+
+    threshold = PASS_THRESHOLD * max_score
+    if status == 'passed':
+        q = q.filter(TestResult.score >= threshold)
+    elif status == 'failed':
+        q = q.filter(TestResult.score < threshold)
+    if date_from:
+        q = q.filter(TestResult.started_at >= date_from)
+    if date_to:
+        q = q.filter(TestResult.started_at < date_to + datetime.timedelta(days=1))
+
+    key = tuple_(sort_col, TestResult.id)
+    if cursor:
+        q = q.filter(key < tuple_(*cursor) if order == 'desc' else key > tuple_(*cursor))
+    if order == 'desc':
+        q = q.order_by(sort_col.desc(), TestResult.id.desc())
     else:
-        avg_score = 0
-        min_score = 0
+        q = q.order_by(sort_col.asc(), TestResult.id.asc())
+
+    rows = q.limit(RESULTS_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(rows) > RESULTS_PAGE_SIZE:
+        rows = rows[:RESULTS_PAGE_SIZE]
+        last = rows[-1]
+        last_value = last.score if sort == 'score' else last.started_at.isoformat()
+        next_cursor = f'{last_value}~{last.id}'
 
-    db.close()
+    filters = {
+        'sort': sort,
+        'order': order,
+        'status': status,
+        'from': request.args.get('from', ''),
+        'to': request.args.get('to', ''),
+    }
     return render_template(
         'tests/results.html',
         test=test,
-        results=results,
+        results=rows,
+        total=total,
         max_score=max_score,
         avg_score=avg_score,
-        min_score=min_score
+        min_score=min_score,
+        pass_threshold=threshold,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=cursor is None,
     )
 
 
+EXPORT_CHUNK_SIZE = 2000
+
+_EXPORT_HEADER = ['ID попытки', 'ФИО', 'Логин', 'Таб. номер', 'Начало', 'Завершение', 'Баллы']
+_EXPORT_ANSWER_HEADER = ['Вопрос', 'Ответ', 'Правильный', 'Балл за ответ']
+
+
+def _export_value(v):
+    if isinstance(v, datetime.datetime):
+        return v.strftime('%Y-%m-%d %H:%M:%S')
+    return v
+
+
+def _export_chunks(stmt, session_factory, with_archived=False):
+    """
+    Читаем строки серверным курсором порциями по EXPORT_CHUNK_SIZE.
+    Сессия живёт ровно столько, сколько генератор (ответ уже отдаётся клиенту).
+    with_archived — последний столбец stmt это TestResult.archived_at: строки
+    заархивированных попыток разворачиваются в ответы из архива.
+    """
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        for part in result.partitions():
+            if with_archived:
+                part = _expand_archived(db, part)
+            yield [tuple(_export_value(v) for v in row) for row in part]
+    finally:
+        db.close()
+
+
+def _expand_archived(db, part):
+    # в user_answers ответов заархивированной попытки нет — join дал одну строку с пустыми ответами
+    archived = archive.load_many(db, [row[0] for row in part if row[-1] is not None])
+    rows = []
+    for row in part:
+        if row[-1] is None:
+            rows.append(row[:-1])
+            continue
+        head = tuple(row[:-5])
+        answers = archived.get(row[0]) or [None]
+        rows.extend(head + ((a.question_text, a.answer_text, a.is_correct, a.score) if a else (None,) * 4)
+                    for a in answers)
+    return rows
+
+
+# с этих символов Excel/LibreOffice начинают формулу: ФИО «=HYPERLINK(...)»
+# из регистрации выполнилось бы у админа, открывшего выгрузку
+_CSV_FORMULA_START = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_safe(v):
+    if isinstance(v, str) and v.startswith(_CSV_FORMULA_START):
+        return "'" + v
+    return v
+
+
+def _iter_csv(header, row_chunks):
+    # BOM + «;» — чтобы Excel с русской локалью открыл файл без мастера импорта
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    writer.writerow(header)
+    yield ('\ufeff' + buf.getvalue()).encode('utf-8')
+    for chunk in row_chunks:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows([_csv_safe(v) for v in row] for row in chunk)
+        yield buf.getvalue().encode('utf-8')
+
+
+@tests_bp.route('/<int:test_id>/export')
+def export_results(test_id):
+    """Выгрузка результатов теста (опционально — со всеми ответами) в CSV/XLSX потоком."""
+    if not is_admin():
+        return redirect(url_for('auth.login'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        abort(400)
+    with_answers = request.args.get('answers') == '1'
+
+    columns = [
+        TestResult.id, User.fio, User.username, User.tab_number,
+        TestResult.started_at, TestResult.passed_at, TestResult.score,
+    ]
+    header = list(_EXPORT_HEADER)
+    if with_answers:
+        columns += [Question.text, Answer.text, Answer.is_correct, Answer.score, TestResult.archived_at]
+        header += _EXPORT_ANSWER_HEADER
+    stmt = select(*columns)\
+        .join(User, User.id == TestResult.user_id)\
+        .where(TestResult.test_id == test_id, TestResult.passed_at.isnot(None))
+    if with_answers:
+        stmt = stmt\
+            .outerjoin(UserAnswer, UserAnswer.result_id == TestResult.id)\
+            .outerjoin(Question, Question.id == UserAnswer.question_id)\
+            .outerjoin(Answer, Answer.id == UserAnswer.answer_id)\
+            .order_by(TestResult.id, UserAnswer.id)
+    else:
+        stmt = stmt.order_by(TestResult.id)
+
+    # реплику выбираем здесь: генератор работает уже вне запроса
+    chunks = _export_chunks(stmt, report_sessionmaker(), with_archived=with_answers)
+    suffix = '_answers' if with_answers else ''
+    if fmt == 'xlsx':
+        body = iter_xlsx(header, chunks, sheet_name='Результаты')
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        body = _iter_csv(header, chunks)
+        mimetype = 'text/csv'
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=test_{test_id}_results{suffix}.{fmt}',
+        'X-Accel-Buffering': 'no',  # чтобы прокси не копил ответ целиком
+    })
+
+
 @tests_bp.route('/result/<int:result_id>')
 def view_result(result_id):
     if not is_admin():
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
+    db = get_report_db()
     result = db.query(TestResult)\
         .options(
             joinedload(TestResult.user),
@@ -285,7 +612,14 @@ def view_result(result_id):
             joinedload(TestResult.answers).joinedload(UserAnswer.answer)
         )\
         .filter_by(id=result_id).first()
-    db.close()
     if not result:
         abort(404)
-    return render_template('tests/user_result.html', result=result)
+    if result.archived_at:
+        answers = archive.load_answers(db, result.id)
+    else:
+        answers = [
+            archive.AnswerRow(ua.question_id, ua.answer_id, ua.question.text,
+                              ua.answer.text, ua.answer.is_correct, ua.answer.score)
+            for ua in sorted(result.answers, key=lambda ua: ua.id)  # порядок ответов, как в архиве
+        ]
+    return render_template('tests/user_result.html', result=result, answers=answers)
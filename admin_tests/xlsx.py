@@ -0,0 +1,198 @@
+"""
+XLSX без сторонних библиотек.
+
+Запись потоковая: книга из одного листа собирается прямо в ZIP-поток,
+строки пишутся в sheet1.xml по мере чтения из БД, а готовые байты
+отдаются генератором. Память не зависит от числа строк.
+
+Чтение — только значения первого листа (для импорта банка вопросов).
+"""
+import math
+import re
+import zipfile
+import zlib
+from xml.etree.ElementTree import iterparse, ParseError
+from xml.sax.saxutils import escape
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+# управляющие символы недопустимы в XML 1.0
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class _Sink:
+    """Файлоподобный буфер без seek: zipfile пишет в него, мы забираем готовые байты."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def write(self, data) -> int:
+        self._buf += data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+def _cell(value) -> str:
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, float) and not math.isfinite(value):
+        return '<c/>'  # nan/inf в <v> — невалидный SpreadsheetML, Excel считает книгу повреждённой
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(values) -> str:
+    return '<row>' + ''.join(_cell(v) for v in values) + '</row>'
+
+
+def iter_xlsx(header, row_chunks, sheet_name='Sheet1'):
+    """
+    Генератор байтов XLSX.
+    header — заголовки столбцов, row_chunks — итератор порций строк (списков кортежей).
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _ROOT_RELS)
+        zf.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name[:31])))
+        zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield sink.take()
+
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((_SHEET_HEAD + _row(header)).encode('utf-8'))
+            for chunk in row_chunks:
+                sheet.write(''.join(_row(r) for r in chunk).encode('utf-8'))
+                data = sink.take()
+                if data:
+                    yield data
+            sheet.write(_SHEET_TAIL.encode('utf-8'))
+    yield sink.take()
+
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_COL_RE = re.compile(r'([A-Z]+)')
+MAX_COLUMNS = 16384  # XFD — последний столбец Excel
+
+# что может бросить read_xlsx_rows на битом или чужом файле;
+# импортёры превращают это в свою ошибку формата
+READ_ERRORS = (ValueError, KeyError, IndexError, ParseError, EOFError, zlib.error, zipfile.BadZipFile)
+
+
+def _col_index(ref: str) -> int:
+    """'C7' -> 2"""
+    m = _COL_RE.match(ref)
+    if not m:
+        raise ValueError(f'Неверная ссылка на ячейку: {ref!r}')
+    n = 0
+    for ch in m.group(1):
+        n = n * 26 + (ord(ch) - ord('A') + 1)
+    if n > MAX_COLUMNS:
+        raise ValueError(f'Неверная ссылка на ячейку: {ref!r}')
+    return n - 1
+
+
+def _text(el) -> str:
+    return ''.join(t.text or '' for t in el.iter(_NS + 't'))
+
+
+def read_xlsx_rows(fileobj):
+    """Итератор строк (списков значений) первого листа. Пустые ячейки — None."""
+    with zipfile.ZipFile(fileobj) as zf:
+        names = zf.namelist()
+        shared = []
+        if 'xl/sharedStrings.xml' in names:
+            with zf.open('xl/sharedStrings.xml') as f:
+                for _, el in iterparse(f):
+                    if el.tag == _NS + 'si':
+                        shared.append(_text(el))
+                        el.clear()
+        sheet = 'xl/worksheets/sheet1.xml'
+        if sheet not in names:
+            sheets = sorted(n for n in names if n.startswith('xl/worksheets/') and n.endswith('.xml'))
+            if not sheets:
+                raise ValueError('В файле нет листов')
+            sheet = sheets[0]
+
+        with zf.open(sheet) as f:
+            for _, el in iterparse(f):
+                if el.tag != _NS + 'row':
+                    continue
+                row = []
+                for c in el.iter(_NS + 'c'):
+                    ref = c.get('r')
+                    idx = _col_index(ref) if ref else len(row)
+                    while len(row) < idx:
+                        row.append(None)
+                    kind = c.get('t')
+                    v = c.find(_NS + 'v')
+                    if kind == 'inlineStr':
+                        value = _text(c)
+                    elif v is None or v.text is None:
+                        value = None
+                    elif kind == 's':
+                        value = shared[int(v.text)]
+                    elif kind == 'b':
+                        value = v.text == '1'
+                    elif kind in ('str', 'e'):
+                        value = v.text
+                    else:
+                        value = float(v.text)
+                        if value.is_integer():
+                            value = int(value)
+                    row.append(value)
+                el.clear()
+                yield row
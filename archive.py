@@ -0,0 +1,176 @@
+"""
+Архив старых попыток.
+
+user_answers прирастает строкой на каждый ответ каждой попытки и никогда
+не уменьшается — вместе с ним дорожают индексы, upsert автосохранения
+и каскадные удаления. Архиватор переносит закрытые попытки старше
+ARCHIVE_AFTER_DAYS в компактное хранилище:
+    * ответы попытки сворачиваются в одну строку attempt_archives —
+      zlib-сжатый JSON-снимок (текст вопроса, текст ответа, верно ли, балл),
+      так что архив не зависит от последующих правок банка;
+    * строки user_answers и attempt_states попытки удаляются;
+    * сама строка test_results остаётся горячей (балл и даты нужны списку
+      результатов, выгрузке и кабинету) и получает archived_at.
+Пачки по ARCHIVE_BATCH, каждая — своя транзакция; на Postgres строки
+берутся FOR UPDATE SKIP LOCKED, как у уборщика.
+
+Чтение: load_answers() / load_many() разворачивают снимок обратно
+в строки AnswerRow — их показывают страницы результата и выгрузка.
+
+    python archive.py            — один проход
+    python archive.py --loop     — проходы каждые ARCHIVE_INTERVAL секунд
+В воркерах включается ARCHIVE_INTERVAL > 0 (см. gunicorn.conf.py).
+"""
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from typing import NamedTuple
+
+from sqlalchemy import select, update, delete, insert
+
+from db import SessionLocal
+from models import TestResult, UserAnswer, Question, Answer, AttemptState, AttemptArchive
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 180))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 200))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 0))
+ARCHIVE_ZLIB_LEVEL = int(os.getenv("ARCHIVE_ZLIB_LEVEL", 6))
+
+FORMAT_VERSION = 1
+
+
+class AnswerRow(NamedTuple):
+    question_id: int
+    answer_id: int
+    question_text: str
+    answer_text: str
+    is_correct: bool
+    score: float
+
+
+# ---------- формат снимка ----------
+
+def pack(rows) -> bytes:
+    payload = {'v': FORMAT_VERSION, 'a': [list(r) for r in rows]}
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                         ARCHIVE_ZLIB_LEVEL)
+
+
+def unpack(blob: bytes) -> list:
+    payload = json.loads(zlib.decompress(blob).decode('utf-8'))
+    if payload.get('v') != FORMAT_VERSION:
+        raise ValueError(f"unknown archive format: {payload.get('v')!r}")
+    return [AnswerRow(*r) for r in payload['a']]
+
+
+# ---------- чтение ----------
+
+def load_answers(db, result_id: int) -> list:
+    """Ответы заархивированной попытки в исходном порядке (пусто, если снимка нет)."""
+    blob = db.execute(select(AttemptArchive.answers).where(AttemptArchive.result_id == result_id)).scalar()
+    return unpack(blob) if blob is not None else []
+
+
+def load_many(db, result_ids) -> dict:
+    """{result_id: [AnswerRow, ...]} одним запросом."""
+    if not result_ids:
+        return {}
+    return {
+        rid: unpack(blob)
+        for rid, blob in db.execute(
+            select(AttemptArchive.result_id, AttemptArchive.answers)
+            .where(AttemptArchive.result_id.in_(list(result_ids)))
+        ).all()
+    }
+
+
+# ---------- перенос ----------
+
+def archive_batch(db, now=None) -> int:
+    """Архивирует одну пачку закрытых попыток старше ARCHIVE_AFTER_DAYS. Коммит — на вызывающей стороне."""
+    now = now or datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+    ids = db.execute(
+        select(TestResult.id)
+        .where(TestResult.archived_at.is_(None), TestResult.passed_at < cutoff)
+        .order_by(TestResult.passed_at)
+        .limit(ARCHIVE_BATCH)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        return 0
+
+    by_result = {rid: [] for rid in ids}
+    for row in db.execute(
+        select(UserAnswer.result_id, UserAnswer.question_id, UserAnswer.answer_id,
+               Question.text, Answer.text, Answer.is_correct, Answer.score)
+        .join(Question, Question.id == UserAnswer.question_id)
+        .join(Answer, Answer.id == UserAnswer.answer_id)
+        .where(UserAnswer.result_id.in_(ids))
+        .order_by(UserAnswer.result_id, UserAnswer.id)
+    ):
+        by_result[row[0]].append(AnswerRow(row[1], row[2], row[3], row[4], bool(row[5]), row[6] or 0.0))
+
+    db.execute(insert(AttemptArchive), [
+        {'result_id': rid, 'answers': pack(rows), 'archived_at': now}
+        for rid, rows in by_result.items()
+    ])
+    db.execute(delete(UserAnswer).where(UserAnswer.result_id.in_(ids))
+               .execution_options(synchronize_session=False))
+    db.execute(delete(AttemptState).where(AttemptState.result_id.in_(ids))
+               .execution_options(synchronize_session=False))
+    db.execute(update(TestResult).where(TestResult.id.in_(ids)).values(archived_at=now)
+               .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def archive(now=None) -> int:
+    """Полный проход: пачки до тех пор, пока есть что архивировать."""
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            n = archive_batch(db, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        total += n
+        if n < ARCHIVE_BATCH:
+            return total
+
+
+def _loop(interval: float) -> None:
+    while True:
+        try:
+            moved = archive()
+            if moved:
+                print(f"[ARCHIVE] archived {moved} attempt(s)")
+        except Exception as e:
+            print(f"[ARCHIVE] pass failed: {e}")
+        time.sleep(interval)
+
+
+_thread = None
+
+
+def start_background(interval: float = ARCHIVE_INTERVAL) -> None:
+    """Фоновый поток архивации в этом процессе (идемпотентно). interval <= 0 — выключено."""
+    global _thread
+    if interval <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _thread = threading.Thread(target=_loop, args=(interval,), name='archive', daemon=True)
+    _thread.start()
+
+
+if __name__ == '__main__':
+    if '--loop' in sys.argv:
+        _loop(ARCHIVE_INTERVAL or 3600)
+    else:
+        print(f"[ARCHIVE] archived {archive()} attempt(s)")
@@ -0,0 +1,174 @@
+"""
+Асинхронный режим (опционально): ASGI-точка входа рядом с app.app.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 2          # или: hypercorn asgi:app
+
+Запросы кандидата во время экзамена (вход, «готов?», открытие и отправка
+попытки) обслуживает Quart: вьюхи асинхронные,
+БД — через асинхронный движок на psycopg 3 (тот же DSN из db._normalize_url),
+так что один процесс держит много кандидатов, ждущих ответа Neon,
+не занимая поток на каждого. Логика попытки общая с Flask-версией
+(user_tests/attempt_flow.py) и вызывается через AsyncSession.run_sync.
+
+Всё остальное (админка, кабинет, результаты, экспорт) — прежнее Flask-приложение
+через WSGI-адаптер. Список тестов тоже остаётся во Flask: там он отдаётся с ETag/304
+и кэшем фрагмента карточек (http_cache), так что в БД почти не ходит. Cookie-сессия совместима: тот же SECRET_KEY и формат.
+"""
+import re
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, g, session, request, redirect, url_for, render_template, flash
+from sqlalchemy import select, update
+from werkzeug.routing import Rule
+
+import db
+import instrumentation
+from app import app as flask_app
+from models import User
+from passwords import averify_password, HashQueueFull, HASH_WAIT
+from papers import get_compiled_test
+from user_tests import attempt_flow as flow
+
+# пути, которые обслуживает асинхронная часть; остальное уходит во Flask
+ASYNC_PATHS = re.compile(r'^/(login|user/tests/\d+/(ready|start))$')
+
+quart_app = Quart(__name__, template_folder='templates')
+quart_app.secret_key = flask_app.secret_key
+quart_app.config['MAX_CONTENT_LENGTH'] = flask_app.config['MAX_CONTENT_LENGTH']
+instrumentation.init_quart(quart_app)
+
+
+# ---------- сессия БД на запрос ----------
+
+def get_adb():
+    """AsyncSession текущего запроса: открывается лениво, закрывается в teardown."""
+    adb = g.get('adb')
+    if adb is None:
+        adb = g.adb = db.async_session()
+    return adb
+
+
+@quart_app.teardown_appcontext
+async def close_adb(exc=None):
+    await release_adb()
+
+
+async def release_adb():
+    """Закрывает асинхронную сессию запроса досрочно (см. db.release_db); дальше — новый get_adb()."""
+    adb = g.pop('adb', None)
+    if adb is not None:
+        try:
+            await adb.rollback()
+        finally:
+            await adb.close()
+
+
+@quart_app.after_serving
+async def dispose_adb():
+    await db.dispose_async_engine()
+
+
+# ---------- вход ----------
+
+@quart_app.route('/login', methods=['GET', 'POST'], endpoint='auth.login')
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        username = form['username']
+        password = form['password']
+
+        adb = get_adb()
+        user = (await adb.execute(
+            select(User.id, User.password, User.is_admin, User.fio).filter_by(username=username)
+        )).first()
+        await release_adb()  # соединение не держим, пока считается хэш
+
+        try:
+            ok, new_hash = await averify_password(user.password, password) if user else (False, None)
+        except HashQueueFull:
+            await flash('Сервер сейчас перегружен, повторите попытку через несколько секунд.')
+            return await render_template('login.html'), 503, {'Retry-After': str(max(1, int(HASH_WAIT)))}
+
+        if ok:
+            if new_hash:
+                adb = get_adb()
+                await adb.execute(update(User).where(User.id == user.id).values(password=new_hash))
+                await adb.commit()
+            session['user_id'] = user.id
+            session['is_admin'] = user.is_admin
+            session['fio'] = user.fio
+            if user.is_admin:
+                return redirect(url_for('auth.admin_dashboard'))
+            return redirect(url_for('auth.user_dashboard'))
+        else:
+            await flash('Неверный логин или пароль')
+    return await render_template('login.html')
+
+
+# ---------- попытка ----------
+
+@quart_app.route('/user/tests/<int:test_id>/ready', endpoint='user_tests.ready_test')
+async def ready_test(test_id: int):
+    if 'user_id' not in session:
+        return redirect(url_for('auth.login'))
+    test = await get_adb().run_sync(get_compiled_test, test_id)
+    if not test:
+        await flash('Тест не найден', 'error')
+        return redirect(url_for('user_tests.list_tests'))
+    return await render_template('user_tests/ready.html', test=test)
+
+
+@quart_app.route('/user/tests/<int:test_id>/start', methods=['GET', 'POST'],
+                 endpoint='user_tests.start_test')
+async def start_test(test_id: int):
+    if 'user_id' not in session:
+        return redirect(url_for('auth.login'))
+
+    user_id = session['user_id']
+    adb = get_adb()
+
+    if request.method == 'GET':
+        opened = await adb.run_sync(flow.open_attempt, user_id, test_id, flow.pop_legacy_selected(session))
+        if not opened.test:
+            await flash('Тест не найден', 'error')
+            return redirect(url_for('user_tests.list_tests'))
+        if opened.questions is None:
+            await flash('В этом тесте пока нет вопросов.', 'warning')
+            return redirect(url_for('user_tests.list_tests'))
+        return await render_template(
+            'user_tests/start.html',
+            test=opened.test,
+            questions=opened.questions,
+            time_limit=opened.time_limit,
+            remaining_seconds=opened.remaining_seconds,
+            selected=opened.selected,
+        )
+
+    form = await request.form
+    outcome = await adb.run_sync(flow.submit_attempt, user_id, test_id, form)
+    (message, category), (endpoint, values) = flow.submission_redirect(outcome, test_id)
+    await flash(message, category)
+    return redirect(url_for(endpoint, **values))
+
+
+# Эндпоинты названы как во Flask-блюпринтах, так что шаблоны и url_for общие.
+# Остальные маршруты Flask — только для построения ссылок (обслуживает их Flask).
+_own = {r.endpoint for r in quart_app.url_map.iter_rules()}
+for _rule in flask_app.url_map.iter_rules():
+    if _rule.endpoint not in _own:
+        quart_app.url_map.add(Rule(_rule.rule, endpoint=_rule.endpoint, methods=_rule.methods, build_only=True))
+
+
+# ---------- диспетчер ----------
+
+_wsgi = WsgiToAsgi(flask_app)
+
+
+async def app(scope, receive, send):
+    """ASGI: горячие пути кандидата — в Quart, остальное — во Flask (lifespan — Quart)."""
+    if scope['type'] == 'lifespan' or (scope['type'] == 'http' and ASYNC_PATHS.match(scope['path'])):
+        await quart_app(scope, receive, send)
+    else:
+        await _wsgi(scope, receive, send)
+
@@ -0,0 +1,118 @@
+"""
+Состояние попытки на сервере.
+
+Выбранные вопросы и порядок вариантов фиксируются один раз при старте
+попытки и хранятся в attempt_states компактным бинарным столбцом
+(массив uint32), а перед ним — маленький LRU-кэш воркера. В cookie
+сессии больше ничего не пишем: заголовки остаются маленькими, попытка
+переживает смену браузера, а POST берёт билет из кэша без проверки cookie.
+"""
+import os
+import random
+import sys
+from array import array
+from dataclasses import replace
+
+from sqlalchemy import select
+
+import sampling
+from lru import LRUCache
+from models import AttemptState
+
+ATTEMPT_CACHE_SIZE = int(os.getenv("ATTEMPT_CACHE_SIZE", 2048))
+
+_cache = LRUCache(ATTEMPT_CACHE_SIZE)
+
+
+def encode_paper(paper) -> bytes:
+    """[(question_id, (answer_id, ...)), ...] -> little-endian uint32: qid, n, aid_1..aid_n, ..."""
+    buf = array('I')
+    for qid, answer_ids in paper:
+        buf.append(qid)
+        buf.append(len(answer_ids))
+        buf.extend(answer_ids)
+    if sys.byteorder != 'little':
+        buf.byteswap()
+    return buf.tobytes()
+
+
+def decode_paper(blob: bytes) -> tuple:
+    buf = array('I')
+    buf.frombytes(blob)
+    if sys.byteorder != 'little':
+        buf.byteswap()
+    paper = []
+    i = 0
+    while i < len(buf):
+        qid, n = buf[i], buf[i + 1]
+        paper.append((qid, tuple(buf[i + 2:i + 2 + n])))
+        i += 2 + n
+    return tuple(paper)
+
+
+def new_paper(compiled, seed: int, question_ids=None) -> tuple:
+    """
+    Собирает билет по зерну попытки: question_ids (или стратифицированная выборка
+    questions_per_attempt из банка, см. sampling.py) + перемешанные варианты каждого вопроса.
+    Одно и то же зерно на той же версии теста даёт тот же билет.
+    """
+    rng = random.Random(seed)
+    if question_ids is None:
+        pool = sampling.get_pool(compiled)
+        n_pick = compiled.questions_per_attempt or pool.size
+        question_ids = sampling.draw(pool, max(1, n_pick), rng)
+    paper = []
+    for q in compiled.pick(question_ids):
+        answer_ids = [a.id for a in q.answers]
+        rng.shuffle(answer_ids)
+        paper.append((q.id, tuple(answer_ids)))
+    return tuple(paper)
+
+
+def save_paper(db, result_id: int, paper, seed: int = None, version: int = None) -> None:
+    """
+    Сохраняет билет в той же транзакции, что и попытку. Коммит — на вызывающей стороне.
+    Сам билет храним всегда: правка банка посреди экзамена не должна менять вопросы
+    в идущей попытке. (seed, version) пишутся рядом для разбора спорных билетов:
+    new_paper с тем же зерном на той же версии теста даёт тот же билет.
+    """
+    db.add(AttemptState(result_id=result_id, paper=encode_paper(paper), seed=seed, version=version))
+    _cache.put(result_id, paper)
+
+
+def load_paper(db, result_id: int):
+    """Билет попытки (кэш → БД) или None, если он ещё не создан."""
+    paper = _cache.get(result_id)
+    if paper is not None:
+        return paper
+    blob = db.execute(
+        select(AttemptState.paper).where(AttemptState.result_id == result_id)
+    ).scalar_one_or_none()
+    if blob is None:
+        return None
+    paper = decode_paper(blob)
+    _cache.put(result_id, paper)
+    return paper
+
+
+def forget(result_id: int) -> None:
+    """Попытка закрыта — билет в кэше больше не нужен."""
+    _cache.pop(result_id)
+
+
+def question_ids(paper) -> list:
+    return [qid for qid, _ in paper]
+
+
+def render_questions(compiled, paper) -> list:
+    """Вопросы билета с вариантами в сохранённом порядке; удалённое из банка пропускаем."""
+    orders = dict(paper)
+    questions = []
+    for q in compiled.pick(orders):
+        by_id = {a.id: a for a in q.answers}
+        order = orders[q.id]
+        answers = [by_id[aid] for aid in order if aid in by_id]
+        # варианты, добавленные в банк после старта попытки, показываем в конце
+        answers += [a for a in q.answers if a.id not in order]
+        questions.append(replace(q, answers=tuple(answers)))
+    return questions
@@ -1,11 +1,25 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from db import SessionLocal
+import hmac
+
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response, abort
+from db import get_db, release_db, get_report_db, get_engine, get_replica_engine, replica_healthy
+from instrumentation import pool_stats, replica_pool_stats, request_stats, METRICS_TOKEN
+from auth.user_search import users_page, attempt_stats, parse_cursor
+from auth.user_import import (parse_users, find_taken, hash_passwords, insert_users,
+                              UserImportError, USER_IMPORT_WEB_MAX_ROWS, USER_IMPORT_WEB_HASH_WORKERS)
 from models import *
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.orm import joinedload  # ← добавили
+from passwords import hash_password, verify_password, HashQueueFull, HASH_WAIT
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 
 auth_bp = Blueprint('auth', __name__)
 
+
+def _busy(template):
+    """Очередь хэширования переполнена: честный 503 вместо долгого ожидания."""
+    flash('Сервер сейчас перегружен, повторите попытку через несколько секунд.')
+    return render_template(template), 503, {'Retry-After': str(max(1, int(HASH_WAIT)))}
+
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
@@ -14,23 +28,33 @@ def register():
         password = request.form['password']
         tab_number = request.form['tab_number']
 
-        db = SessionLocal()
-        user = db.query(User).filter_by(username=username).first()
-        if user:
+        db = get_db()
+        taken = db.query(User.id).filter_by(username=username).first()
+        if taken:
             flash('Логин уже занят!')
-            db.close()
             return redirect(url_for('auth.register'))
+        release_db()  # соединение не держим, пока считается хэш
 
+        try:
+            password_hash = hash_password(password)
+        except HashQueueFull:
+            return _busy('register.html')
+
+        db = get_db()
         user = User(
             fio=fio,
             username=username,
-            password=generate_password_hash(password),
+            password=password_hash,
             tab_number=tab_number,
             is_admin=False
         )
         db.add(user)
-        db.commit()
-        db.close()
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            flash('Логин уже занят!')
+            return redirect(url_for('auth.register'))
         flash('Регистрация успешна! Теперь войдите.')
         return redirect(url_for('auth.login'))
 
@@ -43,10 +67,22 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        db = SessionLocal()
-        user = db.query(User).filter_by(username=username).first()
-        db.close()
-        if user and check_password_hash(user.password, password):
+        db = get_db()
+        user = db.query(User.id, User.password, User.is_admin, User.fio)\
+            .filter_by(username=username).first()
+        release_db()  # соединение не держим, пока считается хэш
+
+        try:
+            ok, new_hash = verify_password(user.password, password) if user else (False, None)
+        except HashQueueFull:
+            return _busy('login.html')
+
+        if ok:
+            if new_hash:
+                # хэш устаревшим методом — тихо пересчитываем при входе
+                db = get_db()
+                db.execute(update(User).where(User.id == user.id).values(password=new_hash))
+                db.commit()
             session['user_id'] = user.id
             session['is_admin'] = user.is_admin
             session['fio'] = user.fio
@@ -62,10 +98,105 @@ def login():
 def admin_dashboard():
     if not session.get('is_admin'):
         return redirect(url_for('auth.login'))
-    db = SessionLocal()
-    users = db.query(User).filter_by(is_admin=False).all()
-    db.close()
-    return render_template('admin_dashboard.html', users=users)
+    db = get_report_db()
+    q = (request.args.get('q') or '').strip()[:100]
+    cursor = parse_cursor(request.args.get('after'))
+    users, next_cursor, total = users_page(db, q, cursor)
+    return render_template(
+        'admin_dashboard.html',
+        users=users,
+        stats=attempt_stats(db, [u.id for u in users]),
+        q=q,
+        total=total,
+        next_cursor=next_cursor,
+        is_first_page=cursor is None,
+        show_users='q' in request.args or cursor is not None,
+    )
+
+
+IMPORT_MAX_ERRORS_SHOWN = 200
+
+
+def _import_page(errors):
+    return render_template(
+        'import_users.html',
+        errors=errors[:IMPORT_MAX_ERRORS_SHOWN],
+        errors_total=len(errors),
+        web_max_rows=USER_IMPORT_WEB_MAX_ROWS,
+    )
+
+
+@auth_bp.route('/admin/users/import', methods=['GET', 'POST'])
+def import_users():
+    """Массовое заведение пользователей из CSV/XLSX (см. auth/user_import.py)."""
+    if not session.get('is_admin'):
+        return redirect(url_for('auth.login'))
+    if request.method == 'GET':
+        return _import_page([])
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Выберите файл для загрузки')
+        return _import_page([])
+    try:
+        users, errors = parse_users(upload.filename, upload.read())
+    except UserImportError as e:
+        return _import_page([str(e)])
+    if not errors and len(users) > USER_IMPORT_WEB_MAX_ROWS:
+        errors = [f'В файле {len(users)} строк: через форму — до {USER_IMPORT_WEB_MAX_ROWS}, '
+                  f'больше — командой python import_users.py']
+    db = get_db()
+    if not errors:
+        errors = find_taken(db, users)
+    if errors:
+        return _import_page(errors)
+    if not users:
+        flash('В файле нет пользователей')
+        return _import_page([])
+    release_db()  # соединение не держим, пока считаются хэши
+
+    hashes = hash_passwords(users, USER_IMPORT_WEB_HASH_WORKERS)
+    db = get_db()
+    try:
+        insert_users(db, users, hashes)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return _import_page(['Часть логинов заняли, пока шёл импорт. Загрузите файл ещё раз.'])
+    flash(f'Импорт завершён: добавлено пользователей — {len(users)}', 'success')
+    return redirect(url_for('auth.admin_dashboard', q=''))
+
+
+@auth_bp.route('/admin/pool')
+def pool_status():
+    """Замеры пула этого воркера: ожидание/удержание соединений по эндпоинтам. ?reset=1 — начать окно заново."""
+    if not session.get('is_admin'):
+        return redirect(url_for('auth.login'))
+    snapshot = pool_stats.snapshot()
+    snapshot['pool'] = get_engine().pool.status_dict()
+    replica = get_replica_engine()
+    if replica is not None:
+        snapshot['replica'] = replica_pool_stats.snapshot()
+        snapshot['replica']['pool'] = replica.pool.status_dict()
+        snapshot['replica']['healthy'] = replica_healthy()
+    if request.args.get('reset') == '1':
+        pool_stats.reset()
+        replica_pool_stats.reset()
+    return jsonify(snapshot)
+
+
+@auth_bp.route('/metrics')
+def metrics():
+    """
+    Гистограммы запросов этого воркера в формате Prometheus. Скрейпер приходит
+    без сессии, с Authorization: Bearer <METRICS_TOKEN>; админ — со своей сессией.
+    Без токена в конфиге и не админу — 404: эндпоинты и тайминги наружу не светим.
+    """
+    if not session.get('is_admin'):
+        given = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not METRICS_TOKEN or not hmac.compare_digest(given, METRICS_TOKEN):
+            abort(404)
+    return Response(request_stats.render(), mimetype='text/plain; version=0.0.4')
 
 
 @auth_bp.route('/dashboard')
@@ -73,40 +204,30 @@ def user_dashboard():
     if not session.get('user_id'):
         return redirect(url_for('auth.login'))
 
-    db = SessionLocal()
-    try:
-        fio = session.get('fio')
-        user_id = session['user_id']
-
-        # Подтягиваем тесты с вопросами и ответами, чтобы посчитать максимум
-        tests = db.query(Test).options(
-            joinedload(Test.questions).joinedload(Question.answers)
-        ).all()
-
-        # Последний результат пользователя по каждому тесту (если нужно — можно выбрать max по времени)
-        user_results = {
-            r.test_id: r
-            for r in db.query(TestResult).filter_by(user_id=user_id).all()
-        }
-
-        # Максимально возможный балл по тесту = сумма max(score) по каждому вопросу
-        max_by_test = {}
-        for t in tests:
-            max_score = 0.0
-            for q in t.questions or []:
-                if q.answers:
-                    max_score += max((a.score for a in q.answers), default=0.0)
-            max_by_test[t.id] = round(max_score, 2)
-
-        return render_template(
-            'user_dashboard.html',
-            fio=fio,
-            tests=tests,
-            user_results=user_results,
-            max_by_test=max_by_test,
-        )
-    finally:
-        db.close()
+    db = get_db()
+    fio = session.get('fio')
+    user_id = session['user_id']
+
+    # Один узкий запрос: тесты + материализованный максимум + сводка пользователя по каждому тесту
+    tests = db.query(
+        Test.id,
+        Test.title,
+        Test.description,
+        Test.max_score,
+        UserTestSummary.attempts,
+        UserTestSummary.best_score,
+        UserTestSummary.last_score,
+        UserTestSummary.last_result_id,
+    ).outerjoin(
+        UserTestSummary,
+        (UserTestSummary.test_id == Test.id) & (UserTestSummary.user_id == user_id)
+    ).order_by(Test.id).all()
+
+    return render_template(
+        'user_dashboard.html',
+        fio=fio,
+        tests=tests,
+    )
 
 
 @auth_bp.route('/logout')
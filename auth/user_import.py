@@ -0,0 +1,169 @@
+"""
+Массовое заведение пользователей (сотрудники отдела) из CSV / XLSX.
+
+Первая строка — заголовок: fio, username, tab_number, password
+(tab_number можно не заполнять). Как и импорт банка вопросов, файл
+сначала целиком разбирается и проверяется:
+    * пустые и слишком длинные поля, повторы логинов внутри файла;
+    * логины, которые уже заняты, — одним запросом на весь файл.
+Если ошибок нет, пароли хэшируются параллельно (passwords.hash_many),
+а пользователи вставляются пакетными INSERT по INSERT_BATCH в одной
+транзакции — либо все, либо никто.
+
+Из админки — /admin/users/import, крупные файлы — python import_users.py.
+Через форму хэши считаются внутри запроса, а это ~0.15 с CPU на пароль
+(scrypt): поэтому там не больше USER_IMPORT_WEB_MAX_ROWS строк (100 —
+~15 с на одном ядре, с запасом до таймаута воркера Gunicorn в 30 с)
+и не больше USER_IMPORT_WEB_HASH_WORKERS процессов, чтобы импорт не
+занимал все ядра сервера посреди экзамена.
+"""
+import csv
+import io
+import os
+from dataclasses import dataclass
+
+from sqlalchemy import select, insert
+
+from admin_tests.xlsx import read_xlsx_rows, READ_ERRORS
+from models import User
+from passwords import hash_many, BULK_HASH_WORKERS
+
+FIO_MAX_LEN = 200
+USERNAME_MAX_LEN = 100
+TAB_NUMBER_MAX_LEN = 20
+INSERT_BATCH = 1000
+USER_IMPORT_MAX_ROWS = int(os.getenv("USER_IMPORT_MAX_ROWS", 20000))
+USER_IMPORT_WEB_MAX_ROWS = int(os.getenv("USER_IMPORT_WEB_MAX_ROWS", 100))
+USER_IMPORT_WEB_HASH_WORKERS = int(os.getenv("USER_IMPORT_WEB_HASH_WORKERS", min(2, BULK_HASH_WORKERS)))
+
+REQUIRED_COLUMNS = ('fio', 'username', 'password')
+
+
+@dataclass
+class ParsedUser:
+    row: int
+    fio: str
+    username: str
+    tab_number: str
+    password: str
+
+
+class UserImportError(ValueError):
+    """Файл не удалось разобрать целиком (формат, кодировка, заголовок)."""
+
+
+def _cell(v) -> str:
+    return '' if v is None else str(v).strip()
+
+
+def _from_table(rows):
+    rows = iter(rows)
+    try:
+        header = [_cell(h).lower() for h in next(rows)]
+    except StopIteration:
+        raise UserImportError('Файл пуст')
+    missing = [name for name in REQUIRED_COLUMNS if name not in header]
+    if missing:
+        raise UserImportError(f'В заголовке нет столбцов: {", ".join(missing)}')
+    col = {name: i for i, name in enumerate(header)}
+
+    def get(r, name, strip=True):
+        i = col.get(name)
+        v = r[i] if i is not None and i < len(r) else None
+        if not strip:
+            return '' if v is None else str(v)
+        return _cell(v)
+
+    users = []
+    for row_no, r in enumerate(rows, start=2):
+        if not any(_cell(v) for v in r):
+            continue
+        users.append(ParsedUser(
+            row=row_no,
+            fio=get(r, 'fio'),
+            username=get(r, 'username'),
+            tab_number=get(r, 'tab_number'),
+            # пароль не обрезаем: пробелы по краям — тоже часть пароля
+            password=get(r, 'password', strip=False),
+        ))
+    return users
+
+
+def parse_users(filename: str, data: bytes):
+    """Разбор файла по расширению -> (users, errors). Ошибки формата — UserImportError."""
+    name = (filename or '').lower()
+    try:
+        if name.endswith('.xlsx'):
+            users = _from_table(read_xlsx_rows(io.BytesIO(data)))
+        elif name.endswith('.csv'):
+            text = data.decode('utf-8-sig')
+            try:
+                dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            users = _from_table(csv.reader(io.StringIO(text, newline=''), dialect))
+        else:
+            raise UserImportError('Поддерживаются файлы .csv и .xlsx')
+    except UserImportError:
+        raise
+    except (UnicodeDecodeError, *READ_ERRORS) as e:
+        raise UserImportError(f'Не удалось прочитать файл: {e}')
+    if len(users) > USER_IMPORT_MAX_ROWS:
+        raise UserImportError(f'В файле {len(users)} строк, максимум — {USER_IMPORT_MAX_ROWS}')
+    return users, validate(users)
+
+
+def validate(users) -> list:
+    errors = []
+    seen = {}
+    for u in users:
+        where = f'Строка {u.row}'
+        if not u.fio:
+            errors.append(f'{where}: пустое ФИО')
+        elif len(u.fio) > FIO_MAX_LEN:
+            errors.append(f'{where}: ФИО длиннее {FIO_MAX_LEN} символов')
+        if not u.username:
+            errors.append(f'{where}: пустой логин')
+        elif len(u.username) > USERNAME_MAX_LEN:
+            errors.append(f'{where}: логин длиннее {USERNAME_MAX_LEN} символов')
+        elif u.username in seen:
+            errors.append(f'{where}: логин {u.username!r} уже есть в строке {seen[u.username]}')
+        else:
+            seen[u.username] = u.row
+        if len(u.tab_number) > TAB_NUMBER_MAX_LEN:
+            errors.append(f'{where}: таб. номер длиннее {TAB_NUMBER_MAX_LEN} символов')
+        if not u.password:
+            errors.append(f'{where}: пустой пароль')
+    return errors
+
+
+def find_taken(db, users) -> list:
+    """Ошибки по логинам, которые уже есть в таблице, — одним запросом на весь файл."""
+    names = list({u.username for u in users if u.username})
+    if not names:
+        return []
+    taken = set(db.execute(select(User.username).where(User.username.in_(names))).scalars())
+    return [f'Строка {u.row}: логин {u.username!r} уже занят' for u in users if u.username in taken]
+
+
+def _batches(items, size=INSERT_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def hash_passwords(users, workers: int = BULK_HASH_WORKERS) -> list:
+    """Хэши паролей в порядке users. Долго — вызывать без открытой транзакции."""
+    return hash_many([u.password for u in users], workers)
+
+
+def insert_users(db, users, hashes) -> int:
+    """Пакетная вставка уже проверенных пользователей. Коммит — на вызывающей стороне."""
+    # render_nulls: строки без таб. номера не откалываются в отдельный INSERT
+    stmt = insert(User).execution_options(render_nulls=True)
+    for batch in _batches(list(zip(users, hashes))):
+        db.execute(stmt, [
+            {'fio': u.fio, 'username': u.username, 'tab_number': u.tab_number or None,
+             'password': h, 'is_admin': False}
+            for u, h in batch
+        ])
+    return len(users)
@@ -0,0 +1,98 @@
+"""
+Список пользователей в админке: поиск по подстроке и постраничный вывод.
+
+Поиск — по ФИО, логину и таб. номеру сразу:
+  * Postgres — LIKE по выражению SEARCH_SQL, под которым лежит триграммный
+    GIN-индекс (migrations/v0006_user_search.py);
+  * SQLite — FTS5-таблица users_search с токенизатором trigram
+    (от 3 символов), короче — и без FTS5 — обычный LIKE.
+Страницы — keyset-курсором «fio~id» по индексу (fio, id), как в результатах
+теста: глубокие страницы не дороже первой.
+Счётчики попыток — одним агрегатом по сводкам для пользователей страницы.
+"""
+import os
+
+from sqlalchemy import select, func, literal_column, or_, tuple_, text
+
+from models import User, UserTestSummary
+
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", 50))
+
+# то же выражение, что в индексе ix_users_search_trgm (v0006) — менять только вместе с ним
+SEARCH_SQL = "lower(coalesce(fio, '') || ' ' || coalesce(username, '') || ' ' || coalesce(tab_number, ''))"
+
+_fts_available = {}  # url движка -> есть ли users_search
+
+
+def _has_fts(db) -> bool:
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _fts_available:
+        _fts_available[key] = bind.dialect.name == 'sqlite' and db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search'"
+        )).first() is not None
+    return _fts_available[key]
+
+
+def _like_pattern(q: str) -> str:
+    escaped = q.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_condition(db, q: str):
+    """Условие WHERE для подстроки q (без учёта регистра) или None, если искать нечего."""
+    q = (q or '').strip()
+    if not q:
+        return None
+    if len(q) >= 3 and _has_fts(db):
+        phrase = '"' + q.replace('"', '""') + '"'
+        return User.id.in_(text('SELECT rowid FROM users_search WHERE users_search MATCH :phrase')
+                           .bindparams(phrase=phrase))
+    if db.get_bind().dialect.name == 'postgresql':
+        return literal_column(SEARCH_SQL).like(_like_pattern(q), escape='\\')
+    pattern = _like_pattern(q)
+    return or_(*(func.lower(col).like(pattern, escape='\\') for col in (User.fio, User.username, User.tab_number)))
+
+
+def parse_cursor(raw):
+    """Курсор «fio~id» последней строки предыдущей страницы."""
+    try:
+        fio, last_id = (raw or '').rsplit('~', 1)
+        return fio, int(last_id)
+    except ValueError:
+        return None
+
+
+def users_page(db, q: str = '', cursor=None, page_size: int = USERS_PAGE_SIZE):
+    """-> (строки id/fio/username/tab_number, курсор следующей страницы или None, всего найдено)."""
+    where = [User.is_admin.is_(False)]
+    cond = search_condition(db, q)
+    if cond is not None:
+        where.append(cond)
+
+    total = db.execute(select(func.count(User.id)).where(*where)).scalar()
+
+    stmt = select(User.id, User.fio, User.username, User.tab_number).where(*where)
+    if cursor:
+        stmt = stmt.where(tuple_(User.fio, User.id) > tuple_(*cursor))
+    rows = db.execute(stmt.order_by(User.fio, User.id).limit(page_size + 1)).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = f'{rows[-1].fio}~{rows[-1].id}'
+    return rows, next_cursor, total
+
+
+def attempt_stats(db, user_ids) -> dict:
+    """{user_id: (попыток всего, тестов начато)} одним агрегатом по сводкам кабинета."""
+    if not user_ids:
+        return {}
+    rows = db.execute(
+        select(UserTestSummary.user_id,
+               func.coalesce(func.sum(UserTestSummary.attempts), 0),
+               func.count(UserTestSummary.test_id))
+        .where(UserTestSummary.user_id.in_(list(user_ids)))
+        .group_by(UserTestSummary.user_id)
+    ).all()
+    return {uid: (attempts, tests) for uid, attempts, tests in rows}
@@ -0,0 +1,143 @@
+"""
+Автосохранение ответов во время попытки (write-behind).
+
+Кандидат выбирает вариант — страница шлёт его на /user/tests/<id>/autosave.
+Запрос ничего не пишет в БД: выбор кладётся в буфер воркера
+{result_id: {question_id: answer_id}} (последний выбор по вопросу побеждает).
+Фоновый поток раз в AUTOSAVE_FLUSH_INTERVAL секунд (или раньше, если
+в буфере набралось AUTOSAVE_MAX_PENDING выборов) сбрасывает всё накопленное
+одним executemany-upsert в user_answers — только для ещё открытых попыток.
+
+Итоговая отправка берёт сохранённые ответы, накладывает поверх форму
+и лишь проверяет и закрывает попытку (см. user_tests/grading.py).
+"""
+import atexit
+import os
+import threading
+
+from sqlalchemy import select
+
+from db import SessionLocal, upsert_insert
+from models import TestResult, UserAnswer
+
+FLUSH_INTERVAL = float(os.getenv("AUTOSAVE_FLUSH_INTERVAL", 2))
+MAX_PENDING = int(os.getenv("AUTOSAVE_MAX_PENDING", 500))
+
+_lock = threading.Lock()
+_pending = {}        # result_id -> {question_id: answer_id}
+_pending_count = 0
+_wake = threading.Event()
+_thread = None
+_thread_pid = None
+
+
+def _ensure_thread() -> None:
+    """Поток сброса — один на процесс, стартует при первом выборе (после fork — заново)."""
+    global _thread, _thread_pid
+    pid = os.getpid()
+    if _thread is not None and _thread_pid == pid and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=_flush_loop, name='autosave-flush', daemon=True)
+    _thread_pid = pid
+    _thread.start()
+
+
+def buffer(result_id: int, choices: dict) -> None:
+    """Кладёт выборы {question_id: answer_id} в буфер. Проверка принадлежности — на вызывающей стороне."""
+    global _pending_count
+    if not choices:
+        return
+    with _lock:
+        _ensure_thread()
+        slot = _pending.setdefault(result_id, {})
+        before = len(slot)
+        slot.update(choices)
+        _pending_count += len(slot) - before
+        if _pending_count >= MAX_PENDING:
+            _wake.set()
+
+
+def pending_for(result_id: int) -> dict:
+    """Ещё не сброшенные выборы попытки (в этом воркере)."""
+    with _lock:
+        return dict(_pending.get(result_id, ()))
+
+
+def discard(result_id: int) -> dict:
+    """Забирает из буфера выборы попытки (она закрывается) и возвращает их."""
+    global _pending_count
+    with _lock:
+        slot = _pending.pop(result_id, {})
+        _pending_count -= len(slot)
+        return slot
+
+
+def _take_all() -> dict:
+    global _pending, _pending_count
+    with _lock:
+        batch, _pending, _pending_count = _pending, {}, 0
+        return batch
+
+
+def write(db, batch: dict) -> int:
+    """
+    Пишет выборы {result_id: {question_id: answer_id}} одним upsert.
+    Закрытые к этому моменту попытки пропускаем: строки открытых попыток
+    блокируются (FOR UPDATE на Postgres), так что закрытие попытки
+    не проскочит между проверкой и записью. Коммит — на вызывающей стороне.
+    """
+    if not batch:
+        return 0
+    open_ids = set(db.execute(
+        select(TestResult.id)
+        .where(TestResult.id.in_(list(batch)), TestResult.passed_at.is_(None))
+        .with_for_update()
+    ).scalars())
+    rows = [
+        {'result_id': rid, 'question_id': qid, 'answer_id': aid}
+        for rid, choices in batch.items() if rid in open_ids
+        for qid, aid in choices.items()
+    ]
+    if rows:
+        stmt = upsert_insert(db, UserAnswer)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[UserAnswer.result_id, UserAnswer.question_id],
+            set_={'answer_id': stmt.excluded.answer_id},
+        ), rows)
+    return len(rows)
+
+
+def flush() -> int:
+    """Сбрасывает весь буфер воркера в БД. При ошибке выборы возвращаются в буфер."""
+    global _pending_count
+    batch = _take_all()
+    if not batch:
+        return 0
+    db = SessionLocal()
+    try:
+        written = write(db, batch)
+        db.commit()
+        return written
+    except Exception as e:
+        db.rollback()
+        # более свежие выборы, пришедшие за время сброса, не перетираем
+        with _lock:
+            for rid, choices in batch.items():
+                for qid, aid in choices.items():
+                    _pending.setdefault(rid, {}).setdefault(qid, aid)
+            _pending_count = sum(len(c) for c in _pending.values())
+        print(f"[AUTOSAVE] flush failed, will retry: {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def _flush_loop() -> None:
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        flush()
+
+
+# при штатной остановке воркера дописываем хвост буфера
+atexit.register(flush)
@@ -0,0 +1,334 @@
+"""
+Бюджет SQL-запросов для каждого маршрута.
+
+Каждый зарегистрированный маршрут прогоняется на двух наборах данных —
+маленьком и большом (в 10–20 раз больше вопросов, вариантов, попыток) —
+и число SQL-операторов сверяется с бюджетом из BUDGETS. Кроме бюджета,
+число запросов не должно расти с объёмом данных: ленивые загрузки
+в шаблонах и запросы «на строку» (N+1) так видны сразу. При нарушении
+печатается список операторов (отпечатки, см. instrumentation.fingerprint).
+
+    python -m bench.query_budget               # код выхода 1 при нарушении
+    python -m bench.query_budget --show        # все счётчики, в т.ч. уложившиеся
+
+Новый маршрут без записи в BUDGETS (или SKIP) — тоже ошибка.
+Каждый размер считается в своём процессе на временной SQLite:
+кэши билетов и движок не переходят из прогона в прогон.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from types import SimpleNamespace
+
+# эндпоинт (+ метод, если у маршрута их несколько) -> максимум SQL-операторов
+# (первый заход: кэши билетов и фрагментов воркера ещё холодные)
+BUDGETS = {
+    'index': 0,
+    'auth.register GET': 0,
+    'auth.register POST': 2,
+    'auth.login GET': 0,
+    'auth.login POST': 1,
+    'auth.logout': 0,
+    'auth.metrics': 0,
+    'auth.pool_status': 0,
+    'auth.admin_dashboard': 4,
+    'auth.import_users GET': 0,
+    'auth.import_users POST': 2,
+    'auth.user_dashboard': 1,
+    'tests.list_tests': 2,
+    'tests.create_test GET': 0,
+    'tests.create_test POST': 1,
+    'tests.view_test': 4,
+    'tests.add_question GET': 1,
+    'tests.add_question POST': 6,
+    'tests.edit_question GET': 1,
+    'tests.edit_question POST': 5,
+    'tests.import_questions GET': 1,
+    'tests.import_questions POST': 7,
+    'tests.edit_test GET': 2,
+    'tests.edit_test POST': 5,
+    'tests.delete_question': 6,
+    'tests.delete_test': 9,
+    'tests.test_results': 3,
+    'tests.export_results': 1,
+    'tests.view_result': 1,
+    'user_tests.list_tests': 2,
+    'user_tests.ready_test': 4,
+    'user_tests.start_test GET': 4,
+    'user_tests.autosave_answers': 1,
+    'user_tests.start_test POST': 6,
+    'user_tests.view_result': 2,
+    'api_v1.login': 1,
+    'api_v1.list_tests': 2,
+    'api_v1.start_attempt': 4,
+    'api_v1.paper': 2,
+    'api_v1.autosave_answers': 1,
+    'api_v1.submit': 6,
+    'api_v1.result': 2,
+}
+
+# маршруты, которые здесь не меряем (с причиной)
+SKIP = {
+    'static': 'файлы, БД не трогает',
+}
+
+SIZES = {
+    'small': dict(tests=3, questions=4, per_attempt=3, answers=3, candidates=3),
+    'large': dict(tests=3, questions=60, per_attempt=30, answers=6, candidates=80),
+}
+
+CSV_BANK = (
+    'question;correct;ans_1;score_1;ans_2;score_2;ans_3;score_3\n'
+    'Imported 1;1;A;1;B;0;C;0\n'
+    'Imported 2;2;A;0;B;1;C;0\n'
+    'Imported 3;3;A;0;B;0;C;1\n'
+).encode('utf-8')
+
+
+CSV_USERS = (
+    'fio;username;tab_number;password\n'
+    'Imported One;imported-1;9001;secret-1\n'
+    'Imported Two;imported-2;;secret-2\n'
+).encode('utf-8')
+
+
+def seed_results(test_id, per_attempt):
+    """Завершённые попытки всех кандидатов по test_id (с ответами и сводками) — Core-вставками."""
+    import datetime
+    from sqlalchemy import select, insert
+    from db import SessionLocal
+    from models import Question, Answer, TestResult, UserAnswer, User
+    import summaries
+
+    db = SessionLocal()
+    try:
+        user_ids = db.execute(select(User.id).where(User.is_admin.is_(False)).order_by(User.id)).scalars().all()
+        picks = db.execute(
+            select(Question.id, Answer.id, Answer.score)
+            .join(Answer, Answer.question_id == Question.id)
+            .where(Question.test_id == test_id, Answer.is_correct.is_(True))
+            .order_by(Question.id)
+            .limit(per_attempt)
+        ).all()
+        now = datetime.datetime.utcnow()
+        result_ids = db.execute(insert(TestResult).returning(TestResult.id, sort_by_parameter_order=True), [
+            {'user_id': uid, 'test_id': test_id, 'score': float(n % (len(picks) + 1)),
+             'started_at': now - datetime.timedelta(minutes=20 + n),
+             'passed_at': now - datetime.timedelta(minutes=5 + n)}
+            for n, uid in enumerate(user_ids)
+        ]).scalars().all()
+        db.execute(insert(UserAnswer), [
+            {'result_id': rid, 'question_id': qid, 'answer_id': aid}
+            for rid in result_ids for qid, aid, _ in picks
+        ])
+        summaries.rebuild(db)
+        db.commit()
+        return user_ids[0], result_ids[0]
+    finally:
+        db.close()
+
+
+def measure(size: str) -> dict:
+    """Один прогон всех сценариев на свежей базе размера size. -> {метка: [SQL, ...]}"""
+    from sqlalchemy import event, select
+    from bench import exam_wave
+    from db import SessionLocal, get_engine
+    from models import Question, Answer
+
+    params = SIZES[size]
+    test_ids = exam_wave.seed(SimpleNamespace(admins=1, seed=1, **params))
+    main_test, scratch_test, doomed_test = test_ids[:3]
+    user_id, result_id = seed_results(main_test, params['per_attempt'])
+    seed_results(doomed_test, params['per_attempt'])  # удаление теста с попытками
+    db = SessionLocal()
+    try:
+        question = db.execute(select(Question.id).where(Question.test_id == scratch_test)
+                              .order_by(Question.id)).scalars().first()
+        answers = db.execute(select(Answer.id, Answer.text, Answer.score, Answer.is_correct)
+                             .where(Answer.question_id == question).order_by(Answer.id)).all()
+        last_question = db.execute(select(Question.id).where(Question.test_id == scratch_test)
+                                   .order_by(Question.id.desc())).scalars().first()
+    finally:
+        db.close()
+
+    from app import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+
+    captured = {'on': False, 'statements': []}
+    main_thread = threading.get_ident()
+
+    def on_query(conn, cursor, statement, parameters, context, executemany):
+        # фоновые потоки (сброс автосохранения) в счёт маршрута не идут
+        if captured['on'] and threading.get_ident() == main_thread:
+            captured['statements'].append(statement)
+
+    event.listen(get_engine(), 'before_cursor_execute', on_query)
+
+    admin = app.test_client()
+    with admin.session_transaction() as s:
+        s.update(user_id=0, is_admin=True, fio='Admin')
+    user = app.test_client()
+    with user.session_transaction() as s:
+        s.update(user_id=user_id, is_admin=False, fio='Candidate')
+    anon = app.test_client()
+
+    results = {}
+
+    def hit(label, client, method, url, **kwargs):
+        captured['on'], captured['statements'] = True, []
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # потоковые ответы (экспорт) читают БД при отдаче
+        captured['on'] = False
+        if response.status_code >= 400:
+            raise RuntimeError(f'{label}: {method} {url} -> {response.status_code}')
+        results[label] = captured['statements']
+        return response
+
+    answer_form = {'text': 'Edited question', 'correct': '1'}
+    for i, a in enumerate(answers, 1):
+        answer_form.update({f'ans_{i}': a.text, f'score_{i}': str(a.score), f'ans_id_{i}': str(a.id)})
+
+    hit('index', anon, 'GET', '/')
+    hit('auth.register GET', anon, 'GET', '/register')
+    hit('auth.register POST', anon, 'POST', '/register',
+        data={'fio': 'New', 'username': 'budget-new', 'password': 'pw', 'tab_number': '1'})
+    hit('auth.login GET', anon, 'GET', '/login')
+    hit('auth.login POST', anon, 'POST', '/login', data={'username': 'bench-0', 'password': exam_wave.CANDIDATE_PASSWORD})
+    hit('auth.logout', anon, 'GET', '/logout')
+    hit('auth.metrics', admin, 'GET', '/metrics')
+    hit('auth.pool_status', admin, 'GET', '/admin/pool')
+    hit('auth.admin_dashboard', admin, 'GET', '/admin?q=Candidate')
+    hit('auth.import_users GET', admin, 'GET', '/admin/users/import')
+    hit('auth.import_users POST', admin, 'POST', '/admin/users/import',
+        data={'file': (io.BytesIO(CSV_USERS), 'users.csv')}, content_type='multipart/form-data')
+    hit('auth.user_dashboard', user, 'GET', '/dashboard')
+
+    hit('tests.list_tests', admin, 'GET', '/tests/')
+    hit('tests.create_test GET', admin, 'GET', '/tests/create')
+    hit('tests.create_test POST', admin, 'POST', '/tests/create',
+        data={'title': 'Budget', 'description': 'x', 'time_limit': '10', 'questions_per_attempt': ''})
+    hit('tests.view_test', admin, 'GET', f'/tests/{main_test}')
+    hit('tests.add_question GET', admin, 'GET', f'/tests/{scratch_test}/add_question')
+    hit('tests.add_question POST', admin, 'POST', f'/tests/{scratch_test}/add_question',
+        data={'text': 'Added', 'correct': '1', 'ans_1': 'A', 'score_1': '1', 'ans_2': 'B', 'score_2': '0'})
+    hit('tests.edit_question GET', admin, 'GET', f'/tests/question/{question}/edit')
+    hit('tests.edit_question POST', admin, 'POST', f'/tests/question/{question}/edit', data=answer_form)
+    hit('tests.import_questions GET', admin, 'GET', f'/tests/{scratch_test}/import')
+    hit('tests.import_questions POST', admin, 'POST', f'/tests/{scratch_test}/import',
+        data={'mode': 'append', 'file': (io.BytesIO(CSV_BANK), 'bank.csv')}, content_type='multipart/form-data')
+    hit('tests.edit_test GET', admin, 'GET', f'/tests/{scratch_test}/edit')
+    hit('tests.edit_test POST', admin, 'POST', f'/tests/{scratch_test}/edit',
+        data={'title': 'Scratch', 'description': 'x', 'time_limit': '30', 'questions_per_attempt': '3'})
+    hit('tests.delete_question', admin, 'POST', f'/tests/question/{last_question}/delete')
+    hit('tests.delete_test', admin, 'POST', f'/tests/{doomed_test}/delete')
+    hit('tests.test_results', admin, 'GET', f'/tests/{main_test}/results')
+    hit('tests.export_results', admin, 'GET', f'/tests/{main_test}/export?answers=1')
+    hit('tests.view_result', admin, 'GET', f'/tests/result/{result_id}')
+
+    hit('user_tests.list_tests', user, 'GET', '/user/tests/')
+    hit('user_tests.ready_test', user, 'GET', f'/user/tests/{main_test}/ready')
+    page = hit('user_tests.start_test GET', user, 'GET', f'/user/tests/{main_test}/start')
+    choices = dict(exam_wave._RADIO_RE.findall(page.get_data(as_text=True)))
+    hit('user_tests.autosave_answers', user, 'POST', f'/user/tests/{main_test}/autosave',
+        json={'answers': {q: int(a) for q, a in list(choices.items())[:2]}})
+    done = hit('user_tests.start_test POST', user, 'POST', f'/user/tests/{main_test}/start',
+               data={f'question_{q}': a for q, a in choices.items()})
+    hit('user_tests.view_result', user, 'GET', done.headers['Location'])
+
+    api = app.test_client()
+    hit('api_v1.login', api, 'POST', '/api/v1/login',
+        json={'username': 'bench-0', 'password': exam_wave.CANDIDATE_PASSWORD})
+    hit('api_v1.list_tests', api, 'GET', '/api/v1/tests')
+    paper = hit('api_v1.start_attempt', api, 'POST', f'/api/v1/tests/{main_test}/attempt', json={}).get_json()['p']
+    hit('api_v1.paper', api, 'GET', f'/api/v1/tests/{main_test}/paper')
+    picks = [[q['id'], q['a'][0][0]] for q in paper['q']]
+    hit('api_v1.autosave_answers', api, 'POST', f'/api/v1/tests/{main_test}/answers', json={'a': picks[:2]})
+    submitted = hit('api_v1.submit', api, 'POST', f'/api/v1/tests/{main_test}/submit', json={'a': picks})
+    hit('api_v1.result', api, 'GET', f"/api/v1/results/{submitted.get_json()['r']}")
+
+    covered = {label.split(' ')[0] for label in results}
+    uncovered = sorted({r.endpoint for r in app.url_map.iter_rules()} - covered - set(SKIP))
+    return {'statements': results, 'uncovered': uncovered}
+
+
+def check(small: dict, large: dict) -> list:
+    from instrumentation import fingerprint
+
+    problems = [f'{e}: route has no query budget (add it to BUDGETS or SKIP)' for e in large['uncovered']]
+    for label in sorted(set(small['statements']) | set(large['statements'])):
+        s = small['statements'].get(label, [])
+        big = large['statements'].get(label, [])
+        budget = BUDGETS.get(label)
+        reasons = []
+        if budget is None:
+            reasons.append('no budget')
+        elif len(big) > budget:
+            reasons.append(f'{len(big)} queries > budget {budget}')
+        if len(big) > len(s):
+            reasons.append(f'grows with data: {len(s)} (small) -> {len(big)} (large)')
+        if reasons:
+            counts = {}
+            for statement in big:
+                fp = fingerprint(statement)
+                counts[fp] = counts.get(fp, 0) + 1
+            listing = '\n'.join(f'      {n}x {fp[:240]}' for fp, n in counts.items())
+            problems.append(f'{label}: ' + '; '.join(reasons) + '\n' + listing)
+    return problems
+
+
+def _measure_in_subprocess(size: str) -> dict:
+    env = dict(os.environ)
+    env.pop('DATABASE_REPLICA_URL', None)
+    db_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix=f'budget-{size}-'), 'budget.db')
+    env.update({
+        'DATABASE_URL': db_url,
+        'BENCH_DROPPABLE_DB': db_url,        # exam_wave.seed очищает только эту базу
+        'PASSWORD_HASH_WORKERS': '0',        # хэш — в том же процессе, без пула
+        'PASSWORD_BULK_HASH_WORKERS': '0',
+        'AUTOSAVE_FLUSH_INTERVAL': '3600',   # сброс буфера не вмешивается в счёт
+        'SLOW_REQUEST_MS': '1000000',
+    })
+    out = subprocess.run(
+        [sys.executable, '-m', 'bench.query_budget', '--measure', size],
+        env=env, capture_output=True, text=True, check=False,
+    )
+    if out.returncode != 0:
+        sys.stderr.write(out.stdout + out.stderr)
+        raise SystemExit(f'[BUDGET] {size} run failed')
+    return json.loads(out.stdout.rsplit('\n@@RESULT@@\n', 1)[1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--measure', choices=sorted(SIZES), help=argparse.SUPPRESS)
+    parser.add_argument('--show', action='store_true', help='печатать счётчики всех маршрутов')
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        result = measure(args.measure)
+        print('\n@@RESULT@@\n' + json.dumps(result))
+        return 0
+
+    small = _measure_in_subprocess('small')
+    large = _measure_in_subprocess('large')
+    if args.show:
+        for label in sorted(large['statements']):
+            print(f"{label:34} small {len(small['statements'].get(label, [])):>3}  "
+                  f"large {len(large['statements'][label]):>3}  budget {BUDGETS.get(label, '-')}")
+    problems = check(small, large)
+    for p in problems:
+        print(f'[BUDGET] FAIL {p}')
+    if problems:
+        return 1
+    print(f"[BUDGET] {len(large['statements'])} routes within budget, none grows with data")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Однократная подготовка БД на деплой: миграции схемы + дефолтный админ.
+
+Запускается отдельно от воркеров (release-команда, `python bootstrap.py`,
+или хук on_starting в gunicorn.conf.py при BOOTSTRAP_ON_START=1).
+На Postgres шаг защищён advisory-lock: если несколько экземпляров стартуют
+одновременно, работает один, остальные ждут и видят, что делать уже нечего.
+"""
+import os
+import sys
+
+from sqlalchemy import text
+
+from db import SessionLocal, get_engine
+from models import User
+import migrations
+from passwords import make_hash
+
+# произвольная константа: ключ advisory-lock для бутстрапа
+BOOTSTRAP_LOCK_KEY = 723_001_009
+
+
+def ensure_default_admin() -> None:
+    """
+    Создаёт дефолтного админа, если ни одного ещё нет.
+       ADMIN_USERNAME (default 'admin')
+       ADMIN_PASSWORD (default 'admin')
+       ADMIN_FIO      (default 'Администратор')
+    """
+    db = SessionLocal()
+    try:
+        any_admin = db.query(User).filter_by(is_admin=True).first()
+        if any_admin:
+            print("[BOOTSTRAP] Admin already exists — skip creating.")
+            return
+
+        username = (os.getenv("ADMIN_USERNAME", "admin") or "admin").strip()
+        password = (os.getenv("ADMIN_PASSWORD", "admin") or "admin").strip()
+        fio      = (os.getenv("ADMIN_FIO", "Администратор") or "Администратор").strip()
+
+        existing = db.query(User).filter_by(username=username).first()
+        if existing:
+            if not existing.is_admin:
+                existing.is_admin = True
+                db.commit()
+                print(f"[BOOTSTRAP] User '{username}' promoted to admin.")
+            else:
+                print(f"[BOOTSTRAP] User '{username}' is already admin.")
+            return
+
+        admin = User(
+            fio=fio,
+            username=username,
+            password=make_hash(password),
+            is_admin=True
+        )
+        db.add(admin)
+        db.commit()
+        print(f"[BOOTSTRAP] Admin '{username}' created.")
+    finally:
+        db.close()
+
+
+def run() -> None:
+    """Миграции + админ под advisory-lock (на Postgres). Идемпотентно."""
+    engine = get_engine()
+    with engine.connect() as lock_conn:
+        use_lock = engine.dialect.name == 'postgresql'
+        if use_lock:
+            lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": BOOTSTRAP_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            migrations.upgrade(engine)
+            for ix in migrations.missing_indexes(engine):
+                print(f"[BOOTSTRAP] WARNING: missing index {ix}")
+            ensure_default_admin()
+            print("[BOOTSTRAP] done")
+        finally:
+            if use_lock:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": BOOTSTRAP_LOCK_KEY})
+                lock_conn.commit()
+
+
+if __name__ == "__main__":
+    try:
+        run()
+    except Exception as e:
+        print(f"[BOOTSTRAP] failed: {e}")
+        sys.exit(1)
@@ -1,12 +1,12 @@
 from db import SessionLocal
 from models import User
-from werkzeug.security import generate_password_hash
+from passwords import make_hash
 
 db = SessionLocal()
 admin = User(
     fio='Администратор',
     username='admin',
-    password=generate_password_hash('admin'),
+    password=make_hash('admin'),
     is_admin=True
 )
 db.add(admin)
@@ -1,8 +1,13 @@
 # db.py
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from flask import g, has_request_context, request, session
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from instrumentation import InstrumentedQueuePool, InstrumentedReplicaQueuePool, attach_engine
+
 Base = declarative_base()
 
 def _normalize_url(url: str) -> str:
@@ -19,26 +24,324 @@ def _normalize_url(url: str) -> str:
         url += ("&" if "?" in url else "?") + "sslmode=require"
     return url
 
-# Только из ENV (не хардкодим секреты)
-DB_URL = os.getenv("DATABASE_URL", "")
-if not DB_URL:
-    raise RuntimeError("DATABASE_URL is not set. Укажите переменную окружения с DSN Neon.")
-
-DB_URL = _normalize_url(DB_URL)
-
-engine = create_engine(
-    DB_URL,
-    future=True,
-    pool_pre_ping=True,   # авто-переподключение
-    pool_recycle=300,     # раз в 5 мин обновляем соединение
-    pool_size=int(os.getenv("DB_POOL_SIZE", 3)),      # чуть скромнее для фритира
-    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 2)),
-    echo=os.getenv("SQL_ECHO", "0") == "1",
+# Движок и пул создаются лениво, при первом обращении к БД, а не при импорте:
+# импорт модуля (в т.ч. в мастере Gunicorn с preload_app) не открывает соединений.
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # Только из ENV (не хардкодим секреты)
+                db_url = os.getenv("DATABASE_URL", "")
+                if not db_url:
+                    raise RuntimeError("DATABASE_URL is not set. Укажите переменную окружения с DSN Neon.")
+                _engine = create_engine(
+                    _normalize_url(db_url),
+                    future=True,
+                    poolclass=InstrumentedQueuePool,  # замеры ожидания/удержания по эндпоинтам
+                    pool_pre_ping=True,   # авто-переподключение
+                    pool_recycle=300,     # раз в 5 мин обновляем соединение
+                    pool_size=int(os.getenv("DB_POOL_SIZE", 3)),      # чуть скромнее для фритира
+                    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 2)),
+                    pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+                    echo=os.getenv("SQL_ECHO", "0") == "1",
+                )
+                attach_engine(_engine)  # SQL-операторы и время БД по запросам
+                if _engine.dialect.name == "sqlite":
+                    event.listen(_engine, "connect", _sqlite_unicode_lower)
+    return _engine
+
+
+def _sqlite_unicode_lower(dbapi_conn, _record):
+    # встроенный lower() в SQLite понимает только ASCII — поиск по кириллице (LIKE) без этого не работает
+    dbapi_conn.create_function("lower", 1, lambda v: v.lower() if isinstance(v, str) else v, deterministic=True)
+
+
+_async_engine = None
+
+
+def _async_url(url: str) -> str:
+    """Тот же DSN для асинхронного движка: psycopg 3 сам выбирает async-вариант драйвера."""
+    if url.startswith("sqlite:"):
+        url = url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+
+def get_async_engine():
+    """Асинхронный движок (режим asgi.py). Создаётся лениво, в том же event loop, что и запросы."""
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from instrumentation import InstrumentedAsyncQueuePool
+
+        db_url = os.getenv("DATABASE_URL", "")
+        if not db_url:
+            raise RuntimeError("DATABASE_URL is not set. Укажите переменную окружения с DSN Neon.")
+        _async_engine = create_async_engine(
+            _async_url(_normalize_url(db_url)),
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            pool_size=int(os.getenv("DB_POOL_SIZE", 3)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 2)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+            echo=os.getenv("SQL_ECHO", "0") == "1",
+        )
+        attach_engine(_async_engine)
+    return _async_engine
+
+
+def upsert_insert(db, model):
+    """INSERT ... ON CONFLICT под диалект текущей БД (Postgres / SQLite)."""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    return dialect_insert(model)
+
+
+def dispose_engine() -> None:
+    """
+    Вызывать в дочернем процессе после fork (Gunicorn post_fork):
+    соединения, унаследованные от мастера, не используем и не закрываем — пул начнётся заново.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False)
+    if _replica_engine is not None:
+        _replica_engine.dispose(close=False)
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+def __getattr__(name):
+    # обратная совместимость: `from db import engine`
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(name)
+
+
+class _LazySessionMaker(sessionmaker):
+    """sessionmaker, который привязывается к движку при создании первой сессии."""
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionMaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+def get_db():
+    """
+    Сессия текущего запроса: открывается при первом обращении,
+    закрывается (с откатом незакоммиченного) в teardown — см. init_app.
+    Маршрутам не нужно закрывать её самим, ранние return не держат соединение.
+    """
+    db = g.get("db")
+    if db is None:
+        db = g.db = SessionLocal()
+    return db
+
+
+def release_db() -> None:
+    """
+    Досрочно закрывает сессию запроса и возвращает соединение в пул — перед
+    долгой работой без БД (хэш пароля). Дальше нужен новый get_db():
+    прежний объект сессии после этого не используем.
+    """
+    db = g.pop("db", None)
+    if db is not None:
+        try:
+            db.rollback()
+        finally:
+            db.close()
+
+
+def close_db(exc=None) -> None:
+    for key in ("report_db", "db"):
+        db = g.pop(key, None)
+        if db is not None:
+            try:
+                db.rollback()
+            finally:
+                db.close()
+
+
+# ---------- реплика для отчётов ----------
+#
+# Отчёты админки (результаты теста, разбор попытки, дашборд, выгрузки) читают
+# много строк и держат соединение заметно дольше, чем кандидатский submit.
+# Если задан DATABASE_REPLICA_URL, они идут на реплику со своим маленьким
+# пулом и в первичный пул не встают вовсе. На первичную БД отчёт возвращается:
+#   * реплика отстаёт больше REPLICA_MAX_LAG_SECONDS или недоступна
+#     (проверка — раз в REPLICA_CHECK_INTERVAL секунд на воркер);
+#   * админ только что что-то менял (POST и т.п.) — REPLICA_STICKY_SECONDS
+#     его отчёты читают с первичной, чтобы он видел свою правку.
+# Соединения реплики открываются в режиме только чтения: запись, случайно
+# попавшая на реплику, упадёт, а не потеряется.
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 10))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 15))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", 3))
+
+# NULL-ы (например, у Neon нет walreceiver) дают отставание по времени последней
+# применённой транзакции: на простаивающем мастере оно растёт, и мы лишь зря
+# уходим на первичную — это безопасная сторона
+_REPLICA_LAG_SQL = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)"
+    " END"
 )
 
-SessionLocal = sessionmaker(
-    bind=engine,
+_replica_engine = None
+_replica_lock = threading.Lock()
+_replica_check_lock = threading.Lock()
+_replica_state = {"checked_at": None, "ok": False}
+
+
+def replica_configured() -> bool:
+    return bool(os.getenv("DATABASE_REPLICA_URL", ""))
+
+
+def get_replica_engine():
+    """Движок реплики (None, если DATABASE_REPLICA_URL не задан). Создаётся лениво, как и основной."""
+    global _replica_engine
+    if _replica_engine is None and replica_configured():
+        with _replica_lock:
+            if _replica_engine is None:
+                url = _normalize_url(os.getenv("DATABASE_REPLICA_URL", ""))
+                connect_args = {}
+                if url.startswith("postgresql"):
+                    connect_args["options"] = "-c default_transaction_read_only=on"
+                    # недоступная реплика не должна вешать проверку (и отчёт, который её ждёт)
+                    # на системный таймаут TCP: через несколько секунд — отказ и чтение с основной
+                    connect_args["connect_timeout"] = REPLICA_CONNECT_TIMEOUT
+                _replica_engine = create_engine(
+                    url,
+                    future=True,
+                    poolclass=InstrumentedReplicaQueuePool,
+                    pool_pre_ping=True,
+                    pool_recycle=300,
+                    pool_size=int(os.getenv("DB_REPLICA_POOL_SIZE", 2)),
+                    max_overflow=int(os.getenv("DB_REPLICA_MAX_OVERFLOW", 1)),
+                    pool_timeout=float(os.getenv("DB_REPLICA_POOL_TIMEOUT", 30)),
+                    connect_args=connect_args,
+                    echo=os.getenv("SQL_ECHO", "0") == "1",
+                )
+                attach_engine(_replica_engine)
+                if _replica_engine.dialect.name == "sqlite":
+                    event.listen(_replica_engine, "connect", _sqlite_unicode_lower)
+    return _replica_engine
+
+
+def replica_lag():
+    """Отставание реплики в секундах (0 для не-Postgres) или None, если до неё не достучаться."""
+    engine = get_replica_engine()
+    if engine is None:
+        return None
+    try:
+        with engine.connect() as conn:
+            if engine.dialect.name != "postgresql":
+                return 0.0
+            return float(conn.execute(_REPLICA_LAG_SQL).scalar() or 0)
+    except Exception as e:
+        print(f"[REPLICA] проверка не удалась: {e.__class__.__name__}: {e}")
+        return None
+
+
+def replica_healthy() -> bool:
+    """Можно ли сейчас читать отчёты с реплики. Результат проверки живёт REPLICA_CHECK_INTERVAL секунд."""
+    if not replica_configured():
+        return False
+    now = time.monotonic()
+    checked_at = _replica_state["checked_at"]
+    if checked_at is not None and now - checked_at < REPLICA_CHECK_INTERVAL:
+        return _replica_state["ok"]
+    if not _replica_check_lock.acquire(blocking=False):
+        return _replica_state["ok"]  # проверяет другой поток — берём прошлый ответ
+    try:
+        lag = replica_lag()
+        ok = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        if ok != _replica_state["ok"]:
+            state = "отчёты на реплике" if ok else "отчёты на первичной БД"
+            print(f"[REPLICA] {state} (отставание: {'нет связи' if lag is None else f'{lag:.1f} с'})")
+        _replica_state.update(checked_at=time.monotonic(), ok=ok)
+        return ok
+    finally:
+        _replica_check_lock.release()
+
+
+ReplicaSessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
     expire_on_commit=False,
 )
+
+
+def _reads_own_writes() -> bool:
+    return has_request_context() and session.get("_primary_until", 0) > time.time()
+
+
+def report_sessionmaker():
+    """
+    Фабрика сессий для отчёта: реплика, если она есть, свежая и пользователь
+    не ждёт своих правок, иначе — первичная БД. Решение принимается при вызове —
+    для потоковой выгрузки вызывать в самом view, до начала ответа.
+    """
+    if _reads_own_writes() or not replica_healthy():
+        return SessionLocal
+    if ReplicaSessionLocal.kw.get("bind") is None:
+        ReplicaSessionLocal.configure(bind=get_replica_engine())
+    return ReplicaSessionLocal
+
+
+def get_report_db():
+    """
+    Сессия для отчётов текущего запроса: только чтение, закрывается в том же teardown,
+    что и get_db(). Без реплики (или в откате на первичную) это и есть get_db().
+    """
+    db = g.get("report_db")
+    if db is None:
+        factory = report_sessionmaker()
+        if factory is SessionLocal:
+            return get_db()
+        db = g.report_db = factory()
+    return db
+
+
+def _stick_to_primary(response):
+    # после изменений админа его отчёты какое-то время читают с первичной БД
+    if (request.method not in ("GET", "HEAD", "OPTIONS")
+            and response.status_code < 400
+            and session.get("is_admin")
+            and replica_configured()):
+        session["_primary_until"] = int(time.time()) + REPLICA_STICKY_SECONDS
+    return response
+
+
+def init_app(app) -> None:
+    app.teardown_appcontext(close_db)
+    app.after_request(_stick_to_primary)
+
+
+def async_session():
+    """Новая AsyncSession (режим asgi.py); параметры как у SessionLocal."""
+    from sqlalchemy.ext.asyncio import AsyncSession
+    return AsyncSession(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
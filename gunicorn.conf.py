@@ -0,0 +1,39 @@
+# gunicorn.conf.py — Gunicorn подхватывает его автоматически из рабочей директории.
+import os
+
+# preload_app: приложение импортируется один раз в мастере, воркеры — fork.
+# Безопасно: при импорте соединений с БД нет (движок ленивый), а после fork пул сбрасывается.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def on_starting(server):
+    # Один раз на запуск мастера (до fork): миграции + админ под advisory-lock.
+    # Если миграции катятся отдельной release-командой (python bootstrap.py),
+    # BOOTSTRAP_ON_START=0 — тогда мастер только проверяет, что схема не отстаёт.
+    if os.getenv("BOOTSTRAP_ON_START", "1") == "1":
+        import bootstrap
+        bootstrap.run()
+        return
+    from db import get_engine
+    from migrations import pending
+    behind = [name for _, name, _ in pending(get_engine())]
+    if behind:
+        raise RuntimeError(f"[BOOTSTRAP] schema is behind, run python bootstrap.py first: {', '.join(behind)}")
+
+
+def post_fork(server, worker):
+    # соединения, открытые в мастере (например, бутстрапом), воркеру не принадлежат
+    import db
+    db.dispose_engine()
+    # уборка просроченных попыток (SWEEPER_INTERVAL > 0); воркеры не мешают друг другу — SKIP LOCKED
+    import sweeper
+    sweeper.start_background()
+    # перенос старых ответов в архив (ARCHIVE_INTERVAL > 0), тоже SKIP LOCKED
+    import archive
+    archive.start_background()
+
+
+def worker_exit(server, worker):
+    # процессы пула хэширования паролей (passwords.py) завершаем вместе с воркером
+    import passwords
+    passwords.shutdown()
@@ -0,0 +1,133 @@
+"""
+HTTP-кэширование редко меняющихся страниц.
+
+Условные GET. Списки тестов, страница теста и результат попытки получают
+слабый ETag из того, что реально определяет их содержимое:
+  * список тестов — пары (id, version) всех тестов (любая правка банка
+    или теста поднимает Test.version, см. papers.bump_test_version);
+  * страница теста — (test_id, version);
+  * результат — (result_id, passed_at), Last-Modified = passed_at
+    (закрытая попытка больше не меняется).
+В ETag входит и то, что base.html берёт из сессии (кто вошёл), и версия
+шаблонов. Совпал If-None-Match / If-Modified-Since — ответ 304 без
+тяжёлого запроса и рендера. Пока в сессии лежат flash-сообщения, 304
+не отдаём: иначе сообщение потеряется.
+
+Кэш фрагментов. Дорогие куски шаблонов (сетка тестов, список вопросов,
+ответы попытки) рендерятся отдельно и лежат в LRU воркера с ключом,
+включающим версию — правка в админке делает старые ключи недостижимыми
+во всех воркерах, а в своём воркере drop_test() (его вызывает
+papers.drop_compiled_test) выкидывает их сразу.
+
+Сжатие. HTML-ответы (и ответы /api/v1) от HTML_GZIP_MIN_BYTES байт сжимаются
+gzip, если клиент это принимает (потоковые ответы — экспорт — не трогаем).
+"""
+import gzip
+import hashlib
+import os
+
+from flask import g, make_response, request, session
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+
+from lru import LRUCache
+
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 256))
+HTML_GZIP_MIN_BYTES = int(os.getenv("HTML_GZIP_MIN_BYTES", 1024))
+HTML_GZIP_LEVEL = int(os.getenv("HTML_GZIP_LEVEL", 6))
+GZIP_MIMETYPES = frozenset({'text/html', 'application/json', 'application/msgpack'})
+
+
+def _templates_version() -> str:
+    """Новая выкладка шаблонов — новые ETag (RELEASE_ID, если задан, иначе mtime файлов)."""
+    release = os.getenv("RELEASE_ID")
+    if release:
+        return release
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    latest = 0.0
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            latest = max(latest, os.path.getmtime(os.path.join(dirpath, name)))
+    return str(int(latest))
+
+
+_TEMPLATES_VERSION = _templates_version()
+
+
+# ---------- условные GET ----------
+
+def make_etag(*parts) -> str:
+    viewer = (session.get('user_id'), bool(session.get('is_admin')), session.get('fio'))
+    raw = repr((_TEMPLATES_VERSION, viewer, parts)).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()
+
+
+def not_modified(etag: str, last_modified=None):
+    """Ответ 304, если копия клиента актуальна, иначе None (рендерим страницу)."""
+    if session.get('_flashes'):
+        # страница покажет (и съест) сообщение — такую копию не сохраняем
+        g.http_cache_skip = True
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(make_response('', 304), etag, last_modified)
+
+
+def with_validators(rv, etag: str, last_modified=None):
+    """Проставляет ETag/Last-Modified; браузер хранит страницу, но каждый раз сверяется."""
+    response = make_response(rv)
+    if g.get('http_cache_skip'):
+        response.cache_control.no_store = True
+        return response
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+# ---------- фрагменты ----------
+
+_fragments = LRUCache(FRAGMENT_CACHE_SIZE)
+
+
+def fragment(key: tuple, render) -> Markup:
+    """
+    Готовый HTML фрагмента по ключу; при промахе вызывает render() и кладёт результат.
+    key — кортеж (имя, test_id или None, версия...), test_id нужен для drop_test.
+    """
+    html = _fragments.get(key)
+    if html is None:
+        html = Markup(render())
+        _fragments.put(key, html)
+    return html
+
+
+def drop_test(test_id: int) -> None:
+    """Выкинуть фрагменты теста и списков тестов из кэша этого воркера."""
+    _fragments.drop_where(lambda key: key[1] == test_id or key[1] is None)
+
+
+# ---------- сжатие ----------
+
+def _gzip_response(response):
+    if (response.status_code != 200
+            or response.mimetype not in GZIP_MIMETYPES
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    body = response.get_data()
+    if len(body) < HTML_GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=HTML_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_app(app) -> None:
+    app.after_request(_gzip_response)
@@ -0,0 +1,68 @@
+"""
+Массовое заведение пользователей из CSV / XLSX (формат — см. auth/user_import.py).
+
+    python import_users.py staff.csv              — проверить и добавить
+    python import_users.py staff.csv --dry-run    — только проверить
+    python import_users.py staff.xlsx --workers 8 — процессов для хэширования
+
+Всё или ничего: при любой ошибке в файле никто не добавляется.
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from auth.user_import import parse_users, find_taken, hash_passwords, insert_users, UserImportError
+from db import SessionLocal
+from passwords import BULK_HASH_WORKERS
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Массовый импорт пользователей')
+    parser.add_argument('path')
+    parser.add_argument('--dry-run', action='store_true', help='только проверить файл')
+    parser.add_argument('--workers', type=int, default=BULK_HASH_WORKERS, help='процессов для хэширования')
+    args = parser.parse_args(argv)
+
+    with open(args.path, 'rb') as f:
+        data = f.read()
+    try:
+        users, errors = parse_users(args.path, data)
+    except UserImportError as e:
+        print(f"[IMPORT] {e}")
+        return 1
+
+    db = SessionLocal()
+    try:
+        if not errors:
+            errors = find_taken(db, users)
+        db.rollback()  # соединение не держим, пока считаются хэши
+        if errors:
+            for e in errors:
+                print(f"[IMPORT] {e}")
+            print(f"[IMPORT] ошибок: {len(errors)}, никто не добавлен")
+            return 1
+        if args.dry_run or not users:
+            print(f"[IMPORT] файл в порядке: пользователей — {len(users)}")
+            return 0
+
+        started = time.perf_counter()
+        hashes = hash_passwords(users, args.workers)
+        hashed = time.perf_counter()
+        print(f"[IMPORT] хэши: {len(users)} за {hashed - started:.1f} с ({max(args.workers, 1)} проц.)")
+        try:
+            insert_users(db, users, hashes)
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            print(f"[IMPORT] логин заняли во время импорта, никто не добавлен: {e.orig}")
+            return 1
+        print(f"[IMPORT] добавлено пользователей: {len(users)} за {time.perf_counter() - hashed:.1f} с")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
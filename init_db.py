@@ -1,2 +1,2 @@
-from werkzeug.security import generate_password_hash
-print(generate_password_hash('admin'))  # ← скопируй результат
+from passwords import make_hash
+print(make_hash('admin'))  # ← скопируй результат
@@ -0,0 +1,440 @@
+"""
+Замеры пула соединений и запросов по эндпоинтам.
+
+InstrumentedQueuePool — обычный QueuePool, который на каждой выдаче
+соединения засекает:
+  * ожидание свободного соединения (wait) и таймауты пула;
+  * выдачи сверх pool_size (overflow);
+  * сколько соединение было на руках до возврата (hold).
+Всё складывается в счётчики по request.endpoint текущего запроса
+(вне запроса — '<background>'). Снимок отдаёт /admin/pool в JSON —
+по нему и подбираются DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT.
+InstrumentedAsyncQueuePool — то же для асинхронного движка (asgi.py),
+InstrumentedReplicaQueuePool — для реплики отчётов, со своими счётчиками
+(replica_pool_stats), чтобы очередь отчётов не смешивалась с кандидатами.
+
+Метрики запроса (всегда включены, без SQL_ECHO):
+  * attach_engine() вешает на движок события before/after_cursor_execute:
+    число SQL-операторов и суммарное время в БД текущего запроса;
+  * init_app() — хуки Flask (и init_quart() — Quart): время всего запроса
+    и рендера шаблонов (сигналы before_render_template / template_rendered);
+  * по эндпоинтам копятся гистограммы, /metrics отдаёт их в текстовом формате
+    Prometheus (счётчики — на процесс-воркер, Prometheus суммирует по инстансам);
+  * запрос дольше SLOW_REQUEST_MS пишется в лог с отпечатками запросов:
+    SQL без литералов, с числом повторов и временем — сразу видно N+1.
+"""
+import contextvars
+import functools
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+BACKGROUND = '<background>'
+_CHECKOUT_KEY = '_instr_checkout'
+
+
+def current_endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or request.path
+    quart = sys.modules.get('quart')  # асинхронный режим (asgi.py), если он загружен
+    if quart is not None and quart.has_request_context():
+        return quart.request.endpoint or quart.request.path
+    return BACKGROUND
+
+
+class _EndpointStats:
+    __slots__ = ('checkouts', 'overflow', 'timeouts',
+                 'wait_total', 'wait_max', 'hold_total', 'hold_max', 'returns')
+
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.returns = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'checkouts': self.checkouts,
+            'overflow': self.overflow,
+            'timeouts': self.timeouts,
+            'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+            'hold_avg_ms': round(self.hold_total / self.returns * 1000, 3) if self.returns else 0.0,
+            'hold_max_ms': round(self.hold_max * 1000, 3),
+        }
+
+
+class PoolStats:
+    """Потокобезопасные счётчики пула по эндпоинтам (на процесс-воркер)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_endpoint = {}
+        self._since = time.time()
+
+    def _get(self, endpoint) -> _EndpointStats:
+        stats = self._by_endpoint.get(endpoint)
+        if stats is None:
+            stats = self._by_endpoint[endpoint] = _EndpointStats()
+        return stats
+
+    def checkout(self, endpoint, wait: float, overflow: bool) -> None:
+        with self._lock:
+            s = self._get(endpoint)
+            s.checkouts += 1
+            s.wait_total += wait
+            s.wait_max = max(s.wait_max, wait)
+            if overflow:
+                s.overflow += 1
+
+    def timeout(self, endpoint, wait: float) -> None:
+        with self._lock:
+            s = self._get(endpoint)
+            s.timeouts += 1
+            s.wait_max = max(s.wait_max, wait)
+
+    def checkin(self, endpoint, hold: float) -> None:
+        with self._lock:
+            s = self._get(endpoint)
+            s.returns += 1
+            s.hold_total += hold
+            s.hold_max = max(s.hold_max, hold)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'since': self._since,
+                'endpoints': {name: s.as_dict() for name, s in sorted(self._by_endpoint.items())},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._by_endpoint.clear()
+            self._since = time.time()
+
+
+pool_stats = PoolStats()
+replica_pool_stats = PoolStats()  # пул реплики для отчётов (db.get_replica_engine)
+
+
+class _InstrumentedPoolMixin:
+    """Замеры ожидания/удержания соединений (см. модуль) поверх любого QueuePool."""
+
+    stats = pool_stats
+
+    def _do_get(self):
+        endpoint = current_endpoint()
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.timeout(endpoint, time.perf_counter() - started)
+            raise
+        now = time.perf_counter()
+        self.stats.checkout(endpoint, now - started, overflow=self.checkedout() > self.size())
+        record.info[_CHECKOUT_KEY] = (endpoint, now)
+        return record
+
+    def _do_return_conn(self, record):
+        mark = record.info.pop(_CHECKOUT_KEY, None)
+        if mark is not None:
+            endpoint, started = mark
+            self.stats.checkin(endpoint, time.perf_counter() - started)
+        super()._do_return_conn(record)
+
+    def status_dict(self) -> dict:
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'idle': self.checkedin(),
+            'timeout_s': self.timeout(),
+        }
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class InstrumentedReplicaQueuePool(InstrumentedQueuePool):
+    stats = replica_pool_stats
+
+
+# ---------- метрики запроса ----------
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_TOP_QUERIES = int(os.getenv("SLOW_TOP_QUERIES", 5))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # /metrics: Authorization: Bearer <token> или сессия админа, иначе 404
+UNMATCHED = '<unmatched>'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Замеры одного запроса. Живёт в contextvar: видна и в потоке Flask, и в задаче Quart."""
+    __slots__ = ('started', 'sql_count', 'sql_time', 'render_time', '_render_started', 'queries', 'status')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.render_time = 0.0
+        self._render_started = None
+        self.queries = {}   # отпечаток -> [число, секунды]
+        self.status = None
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+|\$\d+|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+|\$\d+|%s))*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """SQL без литералов и с IN-списками любой длины, свёрнутыми в (?...): одинаковые запросы склеиваются."""
+    fp = _LITERALS.sub('?', statement)
+    fp = _IN_LISTS.sub('(?...)', fp)
+    return _SPACES.sub(' ', fp).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('_instr_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    m = _current.get()
+    if m is None:
+        return
+    stack = conn.info.get('_instr_query_started')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    m.sql_count += 1
+    m.sql_time += elapsed
+    slot = m.queries.get(statement)
+    if slot is None:
+        m.queries[statement] = [1, elapsed]
+    else:
+        slot[0] += 1
+        slot[1] += elapsed
+
+
+def attach_engine(engine) -> None:
+    """Подсчёт SQL-операторов запроса на движке (для асинхронного — на его sync_engine)."""
+    engine = getattr(engine, 'sync_engine', engine)
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+# имя метрики -> (справка, границы корзин)
+_HISTOGRAMS = {
+    'exam_request_duration_seconds': ('Время обработки запроса', DURATION_BUCKETS),
+    'exam_request_db_seconds': ('Суммарное время SQL за запрос', DURATION_BUCKETS),
+    'exam_request_render_seconds': ('Время рендера шаблонов за запрос', DURATION_BUCKETS),
+    'exam_request_sql_statements': ('Число SQL-операторов за запрос', COUNT_BUCKETS),
+}
+
+
+class RequestStats:
+    """Гистограммы по эндпоинтам и счётчик ответов по статусу (на процесс-воркер)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hist = {name: {} for name in _HISTOGRAMS}
+        self._responses = {}   # (endpoint, status) -> число
+
+    def observe(self, endpoint, m: RequestMetrics, duration: float) -> None:
+        values = {
+            'exam_request_duration_seconds': duration,
+            'exam_request_db_seconds': m.sql_time,
+            'exam_request_render_seconds': m.render_time,
+            'exam_request_sql_statements': m.sql_count,
+        }
+        with self._lock:
+            for name, value in values.items():
+                by_endpoint = self._hist[name]
+                h = by_endpoint.get(endpoint)
+                if h is None:
+                    h = by_endpoint[endpoint] = _Histogram(_HISTOGRAMS[name][1])
+                h.observe(value)
+            key = (endpoint, m.status or 500)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in _HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, h in sorted(self._hist[name].items()):
+                    label = _label(endpoint)
+                    cumulative = 0
+                    for bound, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{{endpoint="{label}",le="{bound:g}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{endpoint="{label}",le="+Inf"}} {h.count}')
+                    lines.append(f'{name}_sum{{endpoint="{label}"}} {h.sum:.6f}')
+                    lines.append(f'{name}_count{{endpoint="{label}"}} {h.count}')
+            lines.append('# HELP exam_responses_total Ответы по эндпоинту и статусу')
+            lines.append('# TYPE exam_responses_total counter')
+            for (endpoint, status), n in sorted(self._responses.items()):
+                lines.append(f'exam_responses_total{{endpoint="{_label(endpoint)}",status="{status}"}} {n}')
+        for name, help_text, key in (
+            ('exam_pool_checkouts_total', 'Выдачи соединений из пула', 'checkouts'),
+            ('exam_pool_overflow_total', 'Выдачи сверх pool_size', 'overflow'),
+            ('exam_pool_timeouts_total', 'Таймауты ожидания соединения', 'timeouts'),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for pool, stats in (('primary', pool_stats), ('replica', replica_pool_stats)):
+                for endpoint, s in stats.snapshot()['endpoints'].items():
+                    lines.append(f'{name}{{pool="{pool}",endpoint="{_label(endpoint)}"}} {s[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_stats = RequestStats()
+
+
+def _metrics_endpoint(req) -> str:
+    # для 404 не берём путь: иначе сканеры раздуют число рядов
+    return req.endpoint or UNMATCHED
+
+
+def _log_slow(endpoint, method, path, m: RequestMetrics, duration: float) -> None:
+    top = sorted(m.queries.items(), key=lambda kv: kv[1][1], reverse=True)
+    merged = {}
+    for statement, (n, t) in top:
+        slot = merged.setdefault(fingerprint(statement), [0, 0.0])
+        slot[0] += n
+        slot[1] += t
+    print(f"[SLOW] {method} {path} ({endpoint}) {duration * 1000:.0f} ms: "
+          f"sql {m.sql_count} / {m.sql_time * 1000:.0f} ms, render {m.render_time * 1000:.0f} ms")
+    for fp, (n, t) in sorted(merged.items(), key=lambda kv: kv[1][1], reverse=True)[:SLOW_TOP_QUERIES]:
+        print(f"[SLOW]   {n}x {t * 1000:.1f} ms  {fp[:300]}")
+
+
+def _start() -> None:
+    _current.set(RequestMetrics())
+
+
+def _set_status(status_code) -> None:
+    m = _current.get()
+    if m is not None:
+        m.status = status_code
+
+
+def _finish(req) -> None:
+    m = _current.get()
+    if m is None:
+        return
+    _current.set(None)
+    duration = time.perf_counter() - m.started
+    endpoint = _metrics_endpoint(req)
+    request_stats.observe(endpoint, m, duration)
+    if duration * 1000 >= SLOW_REQUEST_MS:
+        _log_slow(endpoint, req.method, req.path, m, duration)
+
+
+def _render_started(sender, **extra) -> None:
+    m = _current.get()
+    if m is not None:
+        m._render_started = time.perf_counter()
+
+
+def _render_done(sender, **extra) -> None:
+    m = _current.get()
+    if m is not None and m._render_started is not None:
+        m.render_time += time.perf_counter() - m._render_started
+        m._render_started = None
+
+
+def init_app(app) -> None:
+    """Хуки Flask: замер запроса от before_request до teardown_request."""
+    from flask import before_render_template, template_rendered
+
+    @app.before_request
+    def _instr_start():
+        _start()
+
+    @app.after_request
+    def _instr_status(response):
+        _set_status(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _instr_finish(exc=None):
+        _finish(request)
+
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_done, app)
+
+
+def init_quart(app) -> None:
+    """То же для асинхронного режима (asgi.py). Хуки — корутины: синхронные Quart увёл бы в поток."""
+    import quart
+    from quart.signals import before_render_template, template_rendered
+
+    @app.before_request
+    async def _instr_start():
+        _start()
+
+    @app.after_request
+    async def _instr_status(response):
+        _set_status(response.status_code)
+        return response
+
+    @app.teardown_request
+    async def _instr_finish(exc=None):
+        _finish(quart.request)
+
+    async def _arender_started(sender, **extra):
+        _render_started(sender)
+
+    async def _arender_done(sender, **extra):
+        _render_done(sender)
+
+    # weak=False: приёмники — замыкания, без ссылки их собрал бы сборщик мусора
+    before_render_template.connect(_arender_started, app, weak=False)
+    template_rendered.connect(_arender_done, app, weak=False)
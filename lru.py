@@ -0,0 +1,34 @@
+"""Маленький потокобезопасный LRU-кэш для данных, живущих в памяти воркера."""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def drop_where(self, predicate) -> None:
+        """Удаляет все ключи, для которых predicate(key) истинно."""
+        with self._lock:
+            for k in [k for k in self._data if predicate(k)]:
+                del self._data[k]
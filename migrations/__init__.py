@@ -0,0 +1,118 @@
+"""
+Версионные миграции схемы.
+
+Каждая миграция — модуль migrations/vNNNN_<имя>.py с функцией upgrade(conn).
+Миграция выполняется в своей транзакции; если ей нужна работа вне транзакции
+(CREATE INDEX CONCURRENTLY), в модуле ставится TRANSACTIONAL = False.
+Применённые версии записываются в таблицу schema_migrations.
+
+    python -m migrations upgrade   — применить новые миграции
+    python -m migrations status    — применённые / ожидающие
+    python -m migrations check     — каких индексов из models.py нет в БД (код выхода 1)
+"""
+import datetime
+import importlib
+import pkgutil
+import re
+
+from sqlalchemy import MetaData, Table, Column, Integer, Unicode, DateTime, select, insert, inspect, text
+
+_meta = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('name', Unicode(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def discover() -> list:
+    """[(version, name, module), ...] по возрастанию версии."""
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        m = re.match(r'v(\d{4})_', info.name)
+        if m:
+            found.append((int(m.group(1)), info.name, importlib.import_module(f'{__name__}.{info.name}')))
+    return sorted(found, key=lambda item: item[0])
+
+
+def applied_versions(engine) -> set:
+    _meta.create_all(engine)
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending(engine) -> list:
+    done = applied_versions(engine)
+    return [(v, name, module) for v, name, module in discover() if v not in done]
+
+
+def upgrade(engine, log=print) -> list:
+    """Применяет все ожидающие миграции по порядку. Возвращает имена применённых."""
+    applied = []
+    for version, name, module in pending(engine):
+        mark = insert(schema_migrations).values(
+            version=version, name=name, applied_at=datetime.datetime.utcnow()
+        )
+        if getattr(module, 'TRANSACTIONAL', True):
+            with engine.begin() as conn:
+                module.upgrade(conn)
+                conn.execute(mark)
+        else:
+            with engine.connect() as conn:
+                module.upgrade(conn.execution_options(isolation_level='AUTOCOMMIT'))
+            with engine.begin() as conn:
+                conn.execute(mark)
+        log(f"[MIGRATIONS] applied {name}")
+        applied.append(name)
+    return applied
+
+
+def index_valid(conn, name: str):
+    """
+    True — индекс есть и рабочий, False — есть, но INVALID (прерванный
+    CREATE INDEX CONCURRENTLY на Postgres), None — индекса нет.
+    """
+    if conn.dialect.name == 'postgresql':
+        return conn.execute(
+            text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)'), {'name': name}
+        ).scalar()
+    table = conn.execute(
+        text("SELECT tbl_name FROM sqlite_master WHERE type = 'index' AND name = :name"), {'name': name}
+    ).scalar() if conn.dialect.name == 'sqlite' else None
+    return True if table else None
+
+
+def create_index(conn, name: str, on: str, unique: bool = False) -> None:
+    """
+    Индекс для миграций с TRANSACTIONAL = False; on — 'ON table (cols) [WHERE ...]'.
+    На Postgres строится CONCURRENTLY. Сборка, прерванная таймаутом, блокировкой
+    или убитым деплоем, оставляет INVALID-индекс, который IF NOT EXISTS молча
+    пропустил бы, — такой сначала удаляем и строим заново.
+    """
+    concurrently = ''
+    if conn.dialect.name == 'postgresql':
+        concurrently = 'CONCURRENTLY '
+        if index_valid(conn, name) is False:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    conn.execute(text(f'CREATE {kind} {concurrently}IF NOT EXISTS {name} {on}'))
+
+
+def missing_indexes(engine) -> list:
+    """Индексы, объявленные в models.py, которых нет в БД: ['table.index (cols)', ...]."""
+    from db import Base
+    import models  # noqa: F401 — регистрируем таблицы в метаданных
+
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        have = set()
+        if table.name in existing_tables:
+            have = {ix['name'] for ix in insp.get_indexes(table.name)}
+        for ix in sorted(table.indexes, key=lambda ix: ix.name):
+            if ix.name not in have:
+                cols = ', '.join(c.name for c in ix.columns)
+                missing.append(f'{table.name}.{ix.name} ({cols})')
+    return missing
@@ -0,0 +1,31 @@
+import sys
+
+from db import get_engine
+from migrations import upgrade, pending, applied_versions, discover, missing_indexes
+
+
+def main(argv) -> int:
+    cmd = argv[1] if len(argv) > 1 else 'upgrade'
+    if cmd == 'upgrade':
+        if not upgrade(get_engine()):
+            print("[MIGRATIONS] up to date")
+        return 0
+    if cmd == 'status':
+        done = applied_versions(get_engine())
+        for version, name, _ in discover():
+            print(f"{'applied' if version in done else 'pending':8} {name}")
+        return 0
+    if cmd == 'check':
+        problems = [f"pending migration: {name}" for _, name, _ in pending(get_engine())]
+        problems += [f"missing index: {ix}" for ix in missing_indexes(get_engine())]
+        for p in problems:
+            print(f"[MIGRATIONS] {p}")
+        if not problems:
+            print("[MIGRATIONS] schema OK")
+        return 1 if problems else 0
+    print("usage: python -m migrations [upgrade|status|check]")
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
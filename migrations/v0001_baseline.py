@@ -0,0 +1,121 @@
+"""
+Базовая схема — как она была до появления миграций.
+
+Таблицы описаны здесь же и заморожены: models.py меняется дальше, а эта
+миграция — нет, поэтому v0002 и следующие накатываются поверх одной и той
+же схемы как обычные изменения по порядку. Для БД, которые раньше
+поднимались только через create_all, досоздаём недостающие таблицы
+и столбцы и заполняем материализованные сводки (тоже замороженным SQL).
+"""
+import datetime
+
+from sqlalchemy import (MetaData, Table, Column, Integer, Boolean, ForeignKey, Float, DateTime,
+                        LargeBinary, Unicode, inspect, text)
+
+_meta = MetaData()
+
+Table(
+    'users', _meta,
+    Column('id', Integer, primary_key=True, index=True),
+    Column('fio', Unicode(200), nullable=False),
+    Column('username', Unicode(100), unique=True, nullable=False),
+    Column('password', Unicode(255), nullable=False),
+    Column('tab_number', Unicode(20)),
+    Column('is_admin', Boolean),
+)
+Table(
+    'tests', _meta,
+    Column('id', Integer, primary_key=True),
+    Column('title', Unicode(255), nullable=False),
+    Column('description', Unicode(1000)),
+    Column('time_limit', Integer),
+    Column('questions_per_attempt', Integer),
+    Column('version', Integer, nullable=False, server_default='1'),
+    Column('max_score', Float, nullable=False, server_default='0'),
+)
+Table(
+    'questions', _meta,
+    Column('id', Integer, primary_key=True),
+    Column('test_id', Integer, ForeignKey('tests.id'), nullable=False),
+    Column('text', Unicode(500), nullable=False),
+)
+Table(
+    'answers', _meta,
+    Column('id', Integer, primary_key=True),
+    Column('question_id', Integer, ForeignKey('questions.id'), nullable=False),
+    Column('text', Unicode(255), nullable=False),
+    Column('is_correct', Boolean),
+    Column('score', Float),
+)
+Table(
+    'test_results', _meta,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id'), nullable=False),
+    Column('test_id', Integer, ForeignKey('tests.id'), nullable=False),
+    Column('started_at', DateTime, nullable=False, default=datetime.datetime.utcnow),
+    Column('passed_at', DateTime),
+    Column('score', Float),
+)
+Table(
+    'attempt_states', _meta,
+    Column('result_id', Integer, ForeignKey('test_results.id', ondelete='CASCADE'), primary_key=True),
+    Column('paper', LargeBinary, nullable=False),
+)
+Table(
+    'user_answers', _meta,
+    Column('id', Integer, primary_key=True),
+    Column('result_id', Integer, ForeignKey('test_results.id'), nullable=False),
+    Column('question_id', Integer, ForeignKey('questions.id'), nullable=False),
+    Column('answer_id', Integer, ForeignKey('answers.id'), nullable=False),
+)
+Table(
+    'user_test_summaries', _meta,
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+    Column('test_id', Integer, ForeignKey('tests.id', ondelete='CASCADE'), primary_key=True),
+    Column('attempts', Integer, nullable=False),
+    Column('best_score', Float),
+    Column('last_score', Float),
+    Column('last_result_id', Integer),
+    Column('last_passed_at', DateTime),
+)
+
+# сумма max(score) по вопросам теста
+_REFRESH_MAX_SCORE = text(
+    "UPDATE tests SET max_score = ("
+    " SELECT COALESCE(SUM(per_q.m), 0) FROM ("
+    "  SELECT q.test_id AS test_id, MAX(a.score) AS m"
+    "  FROM answers a JOIN questions q ON q.id = a.question_id"
+    "  GROUP BY q.id, q.test_id"
+    " ) per_q WHERE per_q.test_id = tests.id)"
+)
+# сводки по закрытым попыткам: число, лучший балл, последняя попытка
+_FILL_SUMMARIES = text(
+    "INSERT INTO user_test_summaries"
+    " (user_id, test_id, attempts, best_score, last_score, last_result_id, last_passed_at)"
+    " SELECT agg.user_id, agg.test_id, agg.attempts, agg.best_score, r.score, r.id, r.passed_at"
+    " FROM ("
+    "  SELECT user_id, test_id, COUNT(id) AS attempts, MAX(score) AS best_score, MAX(id) AS last_id"
+    "  FROM test_results WHERE passed_at IS NOT NULL GROUP BY user_id, test_id"
+    " ) agg JOIN test_results r ON r.id = agg.last_id"
+)
+
+
+def upgrade(conn):
+    insp = inspect(conn)
+    had_tests = insp.has_table('tests')
+    had_summaries = insp.has_table('user_test_summaries')
+
+    _meta.create_all(conn)  # только отсутствующие таблицы
+    if not had_tests:
+        return
+
+    columns = {c['name'] for c in insp.get_columns('tests')}
+    if 'version' not in columns:
+        conn.execute(text("ALTER TABLE tests ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+    if 'max_score' not in columns:
+        conn.execute(text("ALTER TABLE tests ADD COLUMN max_score DOUBLE PRECISION NOT NULL DEFAULT 0"))
+
+    if 'max_score' not in columns or not had_summaries:
+        conn.execute(_REFRESH_MAX_SCORE)
+        conn.execute(text("DELETE FROM user_test_summaries"))
+        conn.execute(_FILL_SUMMARIES)
@@ -0,0 +1,24 @@
+"""
+Индексы под горячие запросы:
+  * поиск открытой попытки в start_test — test_results(user_id, test_id, passed_at);
+  * страница результатов — test_results(test_id, score);
+  * ответы попытки / вопросы теста / варианты вопроса — по внешним ключам.
+
+На Postgres строим CONCURRENTLY, чтобы не блокировать запись на рабочей базе.
+"""
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+INDEXES = [
+    ('ix_test_results_user_test_passed', 'test_results', 'user_id, test_id, passed_at'),
+    ('ix_test_results_test_score', 'test_results', 'test_id, score'),
+    ('ix_user_answers_result_id', 'user_answers', 'result_id'),
+    ('ix_questions_test_id', 'questions', 'test_id'),
+    ('ix_answers_question_id', 'answers', 'question_id'),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, f'ON {table} ({columns})')
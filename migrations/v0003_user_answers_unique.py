@@ -0,0 +1,44 @@
+"""
+Одна строка user_answers на (попытка, вопрос) — под upsert автосохранения.
+
+Возможные дубли (старые данные) схлопываем, оставляя последнюю запись.
+Уникальный индекс (result_id, question_id) покрывает и поиск по result_id,
+поэтому отдельный ix_user_answers_result_id больше не нужен — но удаляем
+его, только когда новый индекс построен и рабочий.
+
+Миграция идёт без транзакции (CONCURRENTLY), и между чисткой и сборкой
+может появиться новый дубль: тогда сборка падает, оставляя INVALID-индекс.
+Такой индекс удаляем, чистим дубли ещё раз и строим заново — до BUILD_ATTEMPTS раз.
+"""
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from migrations import create_index, index_valid
+
+TRANSACTIONAL = False
+
+BUILD_ATTEMPTS = 3
+INDEX = 'ux_user_answers_result_question'
+
+
+def _dedup(conn):
+    conn.execute(text(
+        'DELETE FROM user_answers WHERE id NOT IN ('
+        'SELECT MAX(id) FROM user_answers GROUP BY result_id, question_id)'
+    ))
+
+
+def upgrade(conn):
+    for attempt in range(1, BUILD_ATTEMPTS + 1):
+        _dedup(conn)  # прямо перед сборкой: дубль мог появиться после прошлой чистки
+        try:
+            create_index(conn, INDEX, 'ON user_answers (result_id, question_id)', unique=True)
+            break
+        except IntegrityError:
+            # create_index на следующем круге удалит оставшийся INVALID-индекс
+            if attempt == BUILD_ATTEMPTS:
+                raise
+    if not index_valid(conn, INDEX):
+        raise RuntimeError(f'{INDEX} is not valid, keeping ix_user_answers_result_id')
+    concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(f'DROP INDEX {concurrently}IF EXISTS ix_user_answers_result_id'))
@@ -0,0 +1,12 @@
+"""
+Частичный индекс по открытым попыткам (passed_at IS NULL) — под уборщик
+просроченных попыток (sweeper.py). Закрытые попытки в него не попадают,
+поэтому он остаётся маленьким при любом объёме истории.
+"""
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_test_results_open', 'ON test_results (test_id, started_at) WHERE passed_at IS NULL')
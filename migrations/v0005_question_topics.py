@@ -0,0 +1,12 @@
+"""
+Темы и веса вопросов (стратифицированная выборка билета, см. sampling.py)
+и зерно выборки в attempt_states.
+"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE questions ADD COLUMN topic VARCHAR(100)"))
+    conn.execute(text("ALTER TABLE questions ADD COLUMN weight DOUBLE PRECISION NOT NULL DEFAULT 1"))
+    conn.execute(text("ALTER TABLE attempt_states ADD COLUMN seed BIGINT"))
+    conn.execute(text("ALTER TABLE attempt_states ADD COLUMN version INTEGER"))
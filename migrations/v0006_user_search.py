@@ -0,0 +1,54 @@
+"""
+Поиск пользователей по подстроке ФИО / логина / таб. номера (админка).
+
+Postgres: pg_trgm и GIN-индекс по выражению — тому же, что строит
+auth/user_search.SEARCH_SQL, иначе планировщик индекс не возьмёт.
+LIKE '%...%' от 3 символов идёт по индексу.
+
+SQLite: внешняя FTS5-таблица users_search с токенизатором trigram
+(подстроки, без учёта регистра) и триггерами синхронизации.
+Если сборка SQLite без FTS5/trigram — пропускаем: поиск работает через LIKE.
+
+Плюс btree (fio, id) — сортировка и keyset-курсор списка.
+"""
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+SEARCH_SQL = "lower(coalesce(fio, '') || ' ' || coalesce(username, '') || ' ' || coalesce(tab_number, ''))"
+
+_SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+    "fio, username, tab_number, content='users', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS users_search_ai AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_search(rowid, fio, username, tab_number) "
+    "VALUES (new.id, new.fio, new.username, new.tab_number); END",
+    "CREATE TRIGGER IF NOT EXISTS users_search_ad AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_search(users_search, rowid, fio, username, tab_number) "
+    "VALUES ('delete', old.id, old.fio, old.username, old.tab_number); END",
+    "CREATE TRIGGER IF NOT EXISTS users_search_au AFTER UPDATE ON users BEGIN "
+    "INSERT INTO users_search(users_search, rowid, fio, username, tab_number) "
+    "VALUES ('delete', old.id, old.fio, old.username, old.tab_number); "
+    "INSERT INTO users_search(rowid, fio, username, tab_number) "
+    "VALUES (new.id, new.fio, new.username, new.tab_number); END",
+    "INSERT INTO users_search(users_search) VALUES ('rebuild')",
+]
+
+
+def upgrade(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        create_index(conn, 'ix_users_search_trgm', f'ON users USING gin (({SEARCH_SQL}) gin_trgm_ops)')
+        create_index(conn, 'ix_users_fio_id', 'ON users (fio, id)')
+        return
+
+    create_index(conn, 'ix_users_fio_id', 'ON users (fio, id)')
+    if conn.dialect.name == 'sqlite':
+        try:
+            for statement in _SQLITE_FTS:
+                conn.execute(text(statement))
+        except OperationalError as e:
+            print(f"[MIGRATIONS] users_search (FTS5 trigram) unavailable, search falls back to LIKE: {e}")
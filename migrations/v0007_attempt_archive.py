@@ -0,0 +1,27 @@
+"""
+Архив старых попыток (archive.py): таблица attempt_archives и столбец
+test_results.archived_at. Индекс для архиватора — отдельно, в v0008
+(CONCURRENTLY не работает внутри транзакции).
+
+Таблица описана здесь же (а не берётся из models.py), чтобы миграция
+не менялась вместе с моделями.
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, DateTime, LargeBinary, ForeignKey, inspect, text
+
+_meta = MetaData()
+# только ради внешнего ключа: test_results уже есть, её не создаём
+Table('test_results', _meta, Column('id', Integer, primary_key=True))
+attempt_archives = Table(
+    'attempt_archives', _meta,
+    Column('result_id', Integer, ForeignKey('test_results.id', ondelete='CASCADE'), primary_key=True),
+    Column('answers', LargeBinary, nullable=False),
+    Column('archived_at', DateTime, nullable=False),
+)
+
+
+def upgrade(conn):
+    # прежняя версия миграции шла без транзакции: если её сборку индекса
+    # прервали, таблица и столбец уже есть, а версия не записана
+    attempt_archives.create(conn, checkfirst=True)
+    if 'archived_at' not in {c['name'] for c in inspect(conn).get_columns('test_results')}:
+        conn.execute(text("ALTER TABLE test_results ADD COLUMN archived_at TIMESTAMP"))
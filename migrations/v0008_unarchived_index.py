@@ -0,0 +1,11 @@
+"""
+Частичный индекс по ещё не заархивированным закрытым попыткам — по нему
+архиватор (archive.py) находит кандидатов. На Postgres — CONCURRENTLY.
+"""
+from migrations import create_index
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_test_results_unarchived', 'ON test_results (passed_at) WHERE archived_at IS NULL')
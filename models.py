@@ -1,11 +1,15 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, Float, DateTime, LargeBinary, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import Unicode
 import datetime
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # список пользователей в админке: сортировка по ФИО с keyset-курсором (fio, id)
+        Index('ix_users_fio_id', 'fio', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     fio = Column(Unicode(200), nullable=False)
@@ -15,6 +19,7 @@ class User(Base):
     is_admin = Column(Boolean, default=False)
 
     results = relationship('TestResult', back_populates='user', cascade="all, delete-orphan")
+    summaries = relationship('UserTestSummary', cascade="all, delete-orphan", passive_deletes=True)
 
 class Test(Base):
     __tablename__ = 'tests'
@@ -23,19 +28,30 @@ class Test(Base):
     description = Column(Unicode(1000))
     time_limit = Column(Integer, nullable=True)  # в минутах, None — неограничено
     questions_per_attempt = Column(Integer, nullable=True)  # ← ДОБАВЛЕНО: сколько вопросов показывать
+    version = Column(Integer, nullable=False, default=1, server_default='1')  # растёт при каждой правке банка (кэш билетов)
+    max_score = Column(Float, nullable=False, default=0.0, server_default='0')  # сумма max(score) по вопросам, см. papers.bump_test_version
     questions = relationship('Question', back_populates='test', cascade="all, delete-orphan")
     results = relationship('TestResult', back_populates='test', cascade="all, delete-orphan")
+    summaries = relationship('UserTestSummary', cascade="all, delete-orphan", passive_deletes=True)
 
 class Question(Base):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('ix_questions_test_id', 'test_id'),
+    )
     id = Column(Integer, primary_key=True)
     test_id = Column(Integer, ForeignKey('tests.id'), nullable=False)
     text = Column(Unicode(500), nullable=False)
+    topic = Column(Unicode(100), nullable=True)  # страта выборки билета (см. sampling.py), None — «без темы»
+    weight = Column(Float, nullable=False, default=1.0, server_default='1')  # вес внутри темы
     answers = relationship('Answer', back_populates='question', cascade="all, delete-orphan")
     test = relationship('Test', back_populates='questions')
 
 class Answer(Base):
     __tablename__ = 'answers'
+    __table_args__ = (
+        Index('ix_answers_question_id', 'question_id'),
+    )
     id = Column(Integer, primary_key=True)
     question_id = Column(Integer, ForeignKey('questions.id'), nullable=False)
     text = Column(Unicode(255), nullable=False)
@@ -47,6 +63,14 @@ class Answer(Base):
 
 class TestResult(Base):
     __tablename__ = 'test_results'
+    __table_args__ = (
+        Index('ix_test_results_user_test_passed', 'user_id', 'test_id', 'passed_at'),  # поиск открытой попытки
+        Index('ix_test_results_test_score', 'test_id', 'score'),                        # страница результатов
+        Index('ix_test_results_open', 'test_id', 'started_at',                          # уборщик (sweeper.py)
+              postgresql_where=text('passed_at IS NULL'), sqlite_where=text('passed_at IS NULL')),
+        Index('ix_test_results_unarchived', 'passed_at',                                # архиватор (archive.py)
+              postgresql_where=text('archived_at IS NULL'), sqlite_where=text('archived_at IS NULL')),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id   = Column(Integer, ForeignKey('users.id'),   nullable=False)
@@ -54,13 +78,39 @@ class TestResult(Base):
     started_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
     passed_at  = Column(DateTime, nullable=True)
     score      = Column(Float,   default=0.0)
+    archived_at = Column(DateTime, nullable=True)  # ответы перенесены в attempt_archives (archive.py)
 
     user    = relationship('User',       back_populates='results')
     test    = relationship('Test',       back_populates='results')
     answers = relationship('UserAnswer', back_populates='result', cascade='all, delete-orphan')
+    state   = relationship('AttemptState', back_populates='result', uselist=False,
+                           cascade='all, delete-orphan', passive_deletes=True)
+    archive = relationship('AttemptArchive', uselist=False,
+                           cascade='all, delete-orphan', passive_deletes=True)
+
+class AttemptState(Base):
+    """Билет попытки на сервере: порядок вопросов и перемешивание вариантов (см. attempts.py)."""
+    __tablename__ = 'attempt_states'
+    result_id = Column(Integer, ForeignKey('test_results.id', ondelete='CASCADE'), primary_key=True)
+    paper     = Column(LargeBinary, nullable=False)  # упакованные uint32: qid, n, aid_1..aid_n, ...
+    seed      = Column(BigInteger, nullable=True)    # зерно выборки: билет воспроизводится по (seed, version)
+    version   = Column(Integer, nullable=True)       # Test.version на момент старта
+
+    result = relationship('TestResult', back_populates='state')
+
+class AttemptArchive(Base):
+    """Ответы заархивированной попытки одним сжатым снимком (см. archive.py); сама попытка остаётся в test_results."""
+    __tablename__ = 'attempt_archives'
+    result_id   = Column(Integer, ForeignKey('test_results.id', ondelete='CASCADE'), primary_key=True)
+    answers     = Column(LargeBinary, nullable=False)  # zlib(JSON): вопрос, ответ, верно ли, балл — в порядке ответов
+    archived_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
 
 class UserAnswer(Base):
     __tablename__ = 'user_answers'
+    __table_args__ = (
+        # одна строка на вопрос попытки: автосохранение делает upsert по этой паре
+        Index('ux_user_answers_result_question', 'result_id', 'question_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     result_id = Column(Integer, ForeignKey('test_results.id'), nullable=False)
     question_id = Column(Integer, ForeignKey('questions.id'), nullable=False)
@@ -69,3 +119,15 @@ class UserAnswer(Base):
     result = relationship('TestResult', back_populates='answers')
     question = relationship('Question')
     answer = relationship('Answer')
+
+class UserTestSummary(Base):
+    """Сводка попыток пользователя по тесту для личного кабинета (см. summaries.py)."""
+    __tablename__ = 'user_test_summaries'
+
+    user_id        = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    test_id        = Column(Integer, ForeignKey('tests.id', ondelete='CASCADE'), primary_key=True)
+    attempts       = Column(Integer, nullable=False, default=0)
+    best_score     = Column(Float)
+    last_score     = Column(Float)
+    last_result_id = Column(Integer)
+    last_passed_at = Column(DateTime)
@@ -0,0 +1,145 @@
+"""
+Скомпилированные тесты (билеты) в памяти воркера.
+
+Банк вопросов меняется только через админку, а читается на каждом
+открытии/отправке попытки. Поэтому держим неизменяемый компактный снимок
+теста (вопросы, варианты, баллы, максимум, лимит времени) в LRU-кэше
+с ключом (test_id, version). Админские изменения увеличивают
+Test.version — следующий запрос в любом воркере увидит новую версию
+и перекомпилирует тест. Проверка версии — один узкий SELECT по PK.
+"""
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+
+import http_cache
+from lru import LRUCache
+from models import Test, Question
+from summaries import refresh_max_score
+
+PAPER_CACHE_SIZE = int(os.getenv("PAPER_CACHE_SIZE", 128))
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledAnswer:
+    id: int
+    text: str
+    score: float
+    is_correct: bool
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledQuestion:
+    id: int
+    text: str
+    answers: tuple
+    topic: str = None
+    weight: float = 1.0
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledTest:
+    id: int
+    version: int
+    title: str
+    description: str
+    time_limit: int
+    questions_per_attempt: int
+    questions: tuple
+    question_ids: tuple
+    by_id: MappingProxyType      # question_id -> CompiledQuestion
+    answer_key: MappingProxyType  # answer_id -> (question_id, score)
+    max_score: float
+
+    def pick(self, question_ids) -> list:
+        """Вопросы в заданном порядке; удалённые из банка молча пропускаем."""
+        return [self.by_id[qid] for qid in question_ids if qid in self.by_id]
+
+
+def _compile(test: Test) -> CompiledTest:
+    questions = []
+    answer_key = {}
+    max_score = 0.0
+    for q in sorted(test.questions, key=lambda q: q.id):
+        answers = tuple(
+            CompiledAnswer(id=a.id, text=a.text, score=a.score or 0.0, is_correct=bool(a.is_correct))
+            for a in sorted(q.answers, key=lambda a: a.id)
+        )
+        for a in answers:
+            answer_key[a.id] = (q.id, a.score)
+        if answers:
+            max_score += max(a.score for a in answers)
+        questions.append(CompiledQuestion(
+            id=q.id, text=q.text, answers=answers,
+            topic=q.topic, weight=1.0 if q.weight is None else q.weight,
+        ))
+
+    questions = tuple(questions)
+    return CompiledTest(
+        id=test.id,
+        version=test.version or 1,
+        title=test.title,
+        description=test.description,
+        time_limit=test.time_limit,
+        questions_per_attempt=test.questions_per_attempt,
+        questions=questions,
+        question_ids=tuple(q.id for q in questions),
+        by_id=MappingProxyType({q.id: q for q in questions}),
+        answer_key=MappingProxyType(answer_key),
+        max_score=round(max_score, 2),
+    )
+
+
+_cache = LRUCache(PAPER_CACHE_SIZE)
+
+
+def drop_compiled_test(test_id: int) -> None:
+    """Выкинуть тест из кэша этого воркера (остальные увидят отсутствие теста по версии)."""
+    _cache.drop_where(lambda key: key[0] == test_id)
+    http_cache.drop_test(test_id)
+
+
+def catalog_versions(db) -> tuple:
+    """((id, version), ...) всех тестов: меняется при любом создании, правке и удалении теста."""
+    return tuple(tuple(row) for row in db.execute(select(Test.id, Test.version).order_by(Test.id)))
+
+
+def get_compiled_test(db, test_id: int):
+    """Скомпилированный тест или None, если теста нет. При попадании в кэш — один запрос."""
+    version = db.execute(select(Test.version).where(Test.id == test_id)).scalar_one_or_none()
+    if version is None:
+        drop_compiled_test(test_id)
+        return None
+
+    compiled = _cache.get((test_id, version))
+    if compiled is not None:
+        return compiled
+
+    test = db.query(Test)\
+        .options(selectinload(Test.questions).selectinload(Question.answers))\
+        .filter_by(id=test_id).first()
+    if not test:
+        return None
+    compiled = _compile(test)
+    drop_compiled_test(test_id)  # старые версии того же теста больше не нужны
+    _cache.put((test_id, compiled.version), compiled)
+    return compiled
+
+
+def bump_test_version(db, test_id: int) -> None:
+    """
+    Помечаем банк теста изменённым и пересчитываем Test.max_score.
+    Вызывать в той же транзакции, что и правку, после изменений в сессии.
+    """
+    db.flush()
+    refresh_max_score(db, test_id)
+    db.execute(
+        update(Test)
+        .where(Test.id == test_id)
+        .values(version=Test.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    drop_compiled_test(test_id)
@@ -0,0 +1,152 @@
+"""
+Хэширование паролей вне потока запроса.
+
+scrypt по умолчанию в Werkzeug требует заметной памяти и CPU: когда к началу
+экзамена одновременно входят сотни человек, воркеры Gunicorn заняты хэшами.
+Поэтому проверка и генерация хэшей идут в небольшом пуле процессов
+(отдельном в каждом воркере, создаётся лениво — уже после fork),
+а число ожидающих задач ограничено: сверх лимита сразу HashQueueFull,
+и маршрут отвечает 503 вместо того, чтобы копить очередь.
+
+Настройки (ENV):
+    PASSWORD_HASH_METHOD   метод Werkzeug, напр. 'scrypt' или 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_WORKERS  процессов в пуле на воркер (0 — считать в потоке запроса)
+    PASSWORD_HASH_QUEUE    сколько задач (в работе + в очереди) допускается одновременно
+    PASSWORD_HASH_WAIT     сколько секунд ждать места в очереди
+    PASSWORD_BULK_HASH_WORKERS  процессов для массового импорта (hash_many); 0 — в текущем процессе
+
+Смена PASSWORD_HASH_METHOD не требует массовой миграции: хэш пользователя
+пересчитывается новым методом при его следующем успешном входе.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 1))
+HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 8))
+HASH_WAIT = float(os.getenv("PASSWORD_HASH_WAIT", 2))
+BULK_HASH_WORKERS = int(os.getenv("PASSWORD_BULK_HASH_WORKERS", os.cpu_count() or 1))
+
+
+class HashQueueFull(RuntimeError):
+    """Очередь хэширования переполнена — запрос лучше повторить позже."""
+
+
+# ---------- то, что выполняется в процессах пула ----------
+
+def make_hash(password: str) -> str:
+    """Хэш текущим методом (синхронно, в вызывающем процессе)."""
+    return generate_password_hash(password, method=HASH_METHOD)
+
+
+def _method_of(stored: str) -> str:
+    return stored.split('$', 1)[0]
+
+
+_canonical_method = None
+
+
+def _current_method() -> str:
+    """Полная запись текущего метода с параметрами ('scrypt' -> 'scrypt:32768:8:1')."""
+    global _canonical_method
+    if _canonical_method is None:
+        _canonical_method = _method_of(generate_password_hash('', method=HASH_METHOD))
+    return _canonical_method
+
+
+def needs_rehash(stored: str) -> bool:
+    return _method_of(stored) != _current_method()
+
+
+def _verify(stored: str, password: str):
+    """(совпал ли пароль, новый хэш или None) — новый хэш, если метод устарел."""
+    if not check_password_hash(stored, password):
+        return False, None
+    if needs_rehash(stored):
+        return True, make_hash(password)
+    return True, None
+
+
+# ---------- пул (на процесс-воркер) ----------
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE)
+_executor = None
+_executor_pid = None
+
+
+def _get_executor():
+    """Пул создаётся при первом обращении в текущем процессе (после fork — заново)."""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                # spawn: дочерние процессы не наследуют соединения и потоки воркера
+                _executor = ProcessPoolExecutor(
+                    max_workers=HASH_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _run(fn, *args):
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _slots.acquire(timeout=HASH_WAIT):
+        raise HashQueueFull("password hashing queue is full")
+    try:
+        return _get_executor().submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    """Хэш нового пароля. Может бросить HashQueueFull."""
+    return _run(make_hash, password)
+
+
+def verify_password(stored: str, password: str):
+    """
+    Проверка пароля. Возвращает (ok, new_hash): new_hash не None, если хэш
+    был сделан устаревшим методом и его надо сохранить. Может бросить HashQueueFull.
+    """
+    return _run(_verify, stored, password)
+
+
+def hash_many(passwords, workers: int = BULK_HASH_WORKERS) -> list:
+    """
+    Хэши для массового импорта пользователей, в порядке паролей.
+    Считаются во временном пуле на workers процессов, а не в пуле входа:
+    очередь HASH_QUEUE остаётся свободной для логинов.
+    """
+    passwords = list(passwords)
+    if workers <= 1 or len(passwords) < 2:
+        return [make_hash(p) for p in passwords]
+    workers = min(workers, len(passwords))
+    chunksize = max(1, len(passwords) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(make_hash, passwords, chunksize=chunksize))
+
+
+async def ahash_password(password: str) -> str:
+    """То же для асинхронного режима: ожидание места и результата — вне event loop."""
+    return await asyncio.to_thread(hash_password, password)
+
+
+async def averify_password(stored: str, password: str):
+    return await asyncio.to_thread(verify_password, stored, password)
+
+
+def shutdown() -> None:
+    global _executor
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,171 @@
+"""
+Выборка вопросов в билет для больших банков.
+
+Раньше каждая новая попытка копировала список всех id вопросов теста
+и звала random.sample. Теперь на каждую версию теста один раз строится
+компактный пул: id вопросов по темам (array('I')) и, если веса разные,
+накопленные веса (array('d')). Пул лежит в LRU воркера с ключом
+(test_id, version), как и скомпилированный тест.
+
+Выборка стратифицированная:
+  * квота темы пропорциональна числу её вопросов с весом > 0 (метод
+    наибольших остатков), так что каждая тема представлена в билете в своей доле;
+  * внутри темы — взвешенная выборка без возвращения по Question.weight
+    (вес 2 — вдвое чаще попадает в билет); при равных весах — обычный sample;
+  * вес 0 — «не брать, пока хватает остальных»: такие вопросы (и темы целиком
+    из них) попадают в билет, только если без них вопросов меньше, чем нужно.
+Стоимость — O(квота · log размера темы), а не O(размера банка).
+
+Всё решает зерно попытки: random.Random(seed) выбирает вопросы и перемешивает
+варианты, так что билет однозначно восстанавливается по (seed, версия теста).
+"""
+import math
+import os
+import secrets
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from lru import LRUCache
+
+POOL_CACHE_SIZE = int(os.getenv("POOL_CACHE_SIZE", 128))
+NO_TOPIC = ''
+
+
+@dataclass(frozen=True, slots=True)
+class Stratum:
+    topic: str
+    ids: array            # array('I') id вопросов темы
+    cumulative: array     # array('d') накопленные веса или None, если веса равны
+    positive: int         # вопросов с весом > 0
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@dataclass(frozen=True, slots=True)
+class QuestionPool:
+    test_id: int
+    version: int
+    strata: tuple         # Stratum, по возрастанию темы
+    size: int
+
+
+def build_pool(compiled) -> QuestionPool:
+    """Пул по скомпилированному тесту (papers.CompiledTest): темы, id и веса."""
+    by_topic = {}
+    for q in compiled.questions:
+        by_topic.setdefault(q.topic or NO_TOPIC, []).append(q)
+    strata = []
+    for topic in sorted(by_topic):
+        questions = by_topic[topic]
+        weights = [q.weight if math.isfinite(q.weight) and q.weight > 0 else 0.0 for q in questions]
+        cumulative = None
+        if len(set(weights)) > 1:
+            cumulative, total = array('d'), 0.0
+            for w in weights:
+                total += w
+                cumulative.append(total)
+        strata.append(Stratum(
+            topic=topic,
+            ids=array('I', (q.id for q in questions)),
+            cumulative=cumulative,
+            positive=sum(1 for w in weights if w > 0),
+        ))
+    return QuestionPool(
+        test_id=compiled.id,
+        version=compiled.version,
+        strata=tuple(strata),
+        size=len(compiled.questions),
+    )
+
+
+_pools = LRUCache(POOL_CACHE_SIZE)
+
+
+def get_pool(compiled) -> QuestionPool:
+    key = (compiled.id, compiled.version)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = build_pool(compiled)
+        _pools.drop_where(lambda k: k[0] == compiled.id)  # старые версии больше не нужны
+        _pools.put(key, pool)
+    return pool
+
+
+def new_seed() -> int:
+    """Зерно новой попытки (влезает в BIGINT)."""
+    return secrets.randbits(63)
+
+
+def _quotas(pool: QuestionPool, n: int, rng) -> list:
+    """
+    Квоты тем, пропорциональные числу вопросов с весом > 0; сумма — ровно n.
+    Нулевые веса добирают остаток, только если положительных не хватило
+    (как и в _weighted_sample_full, где они идут в конец).
+    """
+    strata = pool.strata
+    positive = sum(s.positive for s in strata)
+    sizes = [len(s) for s in strata]
+    caps = [s.positive for s in strata] if positive else sizes
+    total = positive or pool.size
+    exact = [min(n, total) * c / total for c in caps]
+    quotas = [math.floor(x) for x in exact]
+    left = n - sum(quotas)
+    # остаток — темам с наибольшей дробной частью (ничьи — случайно, но детерминированно по зерну)
+    order = sorted(range(len(strata)), key=lambda i: (-(exact[i] - quotas[i]), rng.random()))
+    for limit in (caps, sizes):
+        while left > 0 and any(quotas[i] < limit[i] for i in order):
+            for i in order:
+                if left and quotas[i] < limit[i]:
+                    quotas[i] += 1
+                    left -= 1
+    return quotas
+
+
+def _weighted_sample(stratum: Stratum, k: int, rng) -> list:
+    """k позиций без возвращения с вероятностью ∝ весу."""
+    if stratum.positive < k or k * 4 > len(stratum):
+        # большая квота (или весов не хватает) — один проход по теме
+        return _weighted_sample_full(stratum, rng)[:k]
+    cumulative = stratum.cumulative
+    total = cumulative[-1]
+    picked, seen = [], set()
+    for _ in range(k * 32):
+        i = bisect_right(cumulative, rng.random() * total)
+        if i < len(stratum) and i not in seen:
+            seen.add(i)
+            picked.append(i)
+            if len(picked) == k:
+                return picked
+    # веса сильно перекошены — повторы съели лимит попыток
+    return _weighted_sample_full(stratum, rng)[:k]
+
+
+def _weighted_sample_full(stratum: Stratum, rng) -> list:
+    """Все позиции темы в случайном взвешенном порядке (Efraimidis–Spirakis); нулевые веса — в конце."""
+    keys = []
+    prev = 0.0
+    for i, c in enumerate(stratum.cumulative):
+        w = c - prev
+        prev = c
+        u = rng.random() or 1e-300
+        keys.append((math.log(u) / w if w > 0 else -math.inf, i))
+    keys.sort(reverse=True)
+    return [i for _, i in keys]
+
+
+def draw(pool: QuestionPool, n: int, rng) -> list:
+    """id n вопросов билета (n >= размера банка — все), в случайном порядке."""
+    n = max(0, min(n, pool.size))
+    picked = []
+    for stratum, k in zip(pool.strata, _quotas(pool, n, rng)):
+        if not k:
+            continue
+        if stratum.cumulative is None:
+            positions = rng.sample(range(len(stratum)), k)
+        else:
+            positions = _weighted_sample(stratum, k, rng)
+        picked.extend(stratum.ids[i] for i in positions)
+    rng.shuffle(picked)
+    return picked
@@ -0,0 +1,121 @@
+"""
+Материализованные данные для личного кабинета.
+
+* Test.max_score — максимально возможный балл (сумма max(score) по вопросам),
+  пересчитывается одним UPDATE при каждой правке банка.
+* user_test_summaries — по строке на (пользователь, тест): число попыток,
+  лучший и последний балл, ссылка на последний результат. Обновляется
+  при проверке попытки, так что кабинет строится одним узким запросом.
+
+Заполнить/пересобрать всё по существующим данным:  python summaries.py
+"""
+from sqlalchemy import select, update, delete, insert, func, case
+
+from db import upsert_insert
+from models import Test, Question, Answer, TestResult, UserTestSummary
+
+
+def refresh_max_score(db, test_id: int = None) -> None:
+    """
+    Пересчитывает Test.max_score одним UPDATE (для одного теста или для всех).
+    Незафлашенные правки сессии к этому моменту должны быть уже сброшены.
+    """
+    per_question = select(Question.test_id, func.max(Answer.score).label('m'))\
+        .join(Question, Question.id == Answer.question_id)\
+        .group_by(Question.id, Question.test_id)\
+        .subquery()
+    total = select(func.coalesce(func.sum(per_question.c.m), 0.0))\
+        .where(per_question.c.test_id == Test.id)\
+        .scalar_subquery()
+    stmt = update(Test).values(max_score=total).execution_options(synchronize_session=False)
+    if test_id is not None:
+        stmt = stmt.where(Test.id == test_id)
+    db.execute(stmt)
+
+
+def record_attempt(db, user_id: int, test_id: int, result_id: int, score: float, passed_at) -> None:
+    """Учитывает закрытую попытку в сводке — один upsert. Коммит — на вызывающей стороне."""
+    record_attempts(db, [{
+        'user_id': user_id,
+        'test_id': test_id,
+        'result_id': result_id,
+        'score': score,
+        'passed_at': passed_at,
+    }])
+
+
+def record_attempts(db, closed) -> None:
+    """
+    То же для пачки закрытых попыток [{user_id, test_id, result_id, score, passed_at}, ...].
+    Попытки одного пользователя по одному тесту в пачке схлопываем заранее:
+    ON CONFLICT не может дважды обновить одну строку в одном INSERT.
+    """
+    merged = {}
+    for row in sorted(closed, key=lambda r: r['result_id']):
+        key = (row['user_id'], row['test_id'])
+        prev = merged.get(key)
+        merged[key] = {
+            'user_id': row['user_id'],
+            'test_id': row['test_id'],
+            'attempts': (prev['attempts'] if prev else 0) + 1,
+            'best_score': max(row['score'], prev['best_score']) if prev else row['score'],
+            'last_score': row['score'],
+            'last_result_id': row['result_id'],
+            'last_passed_at': row['passed_at'],
+        }
+    if not merged:
+        return
+
+    S = UserTestSummary
+    stmt = upsert_insert(db, S)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[S.user_id, S.test_id],
+        set_={
+            'attempts': S.attempts + stmt.excluded.attempts,
+            'best_score': case(
+                (S.best_score >= stmt.excluded.best_score, S.best_score),
+                else_=stmt.excluded.best_score,
+            ),
+            'last_score': stmt.excluded.last_score,
+            'last_result_id': stmt.excluded.last_result_id,
+            'last_passed_at': stmt.excluded.last_passed_at,
+        },
+    )
+    db.execute(stmt, list(merged.values()))
+
+
+def rebuild(db) -> None:
+    """Полная пересборка max_score и сводок по закрытым попыткам (set-based, без циклов по строкам)."""
+    refresh_max_score(db)
+
+    agg = select(
+        TestResult.user_id,
+        TestResult.test_id,
+        func.count(TestResult.id).label('attempts'),
+        func.max(TestResult.score).label('best_score'),
+        func.max(TestResult.id).label('last_id'),
+    ).where(TestResult.passed_at.isnot(None))\
+     .group_by(TestResult.user_id, TestResult.test_id)\
+     .subquery()
+    rows = select(
+        agg.c.user_id, agg.c.test_id, agg.c.attempts, agg.c.best_score,
+        TestResult.score, TestResult.id, TestResult.passed_at,
+    ).join(TestResult, TestResult.id == agg.c.last_id)
+
+    db.execute(delete(UserTestSummary))
+    db.execute(insert(UserTestSummary).from_select(
+        ['user_id', 'test_id', 'attempts', 'best_score', 'last_score', 'last_result_id', 'last_passed_at'],
+        rows,
+    ))
+
+
+if __name__ == '__main__':
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        db.commit()
+        print("[SUMMARIES] rebuilt")
+    finally:
+        db.close()
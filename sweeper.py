@@ -0,0 +1,155 @@
+"""
+Закрытие просроченных попыток пачками.
+
+Попытка с лимитом времени закрывается сама, только если кандидат снова
+отправит форму. Брошенные попытки так и висели с passed_at = NULL.
+Уборщик находит попытки, у которых вышло время (с запасом SWEEP_GRACE_SECONDS
+на автосохранение и сетевые задержки), и закрывает их пачками по SWEEP_BATCH:
+    * балл — сумма баллов автосохранённых ответов (один UPDATE на пачку);
+    * passed_at — момент окончания лимита, а не время уборки;
+    * сводки кабинета — один upsert на пачку.
+На Postgres строки берутся FOR UPDATE SKIP LOCKED: несколько воркеров
+и параллельная отправка формы друг другу не мешают.
+
+    python sweeper.py            — один проход
+    python sweeper.py --loop     — проходы каждые SWEEPER_INTERVAL секунд
+В воркерах включается SWEEPER_INTERVAL > 0 (см. gunicorn.conf.py).
+"""
+import datetime
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import select, update, func, or_, and_, bindparam
+
+import autosave
+from attempts import forget
+from db import SessionLocal
+from models import Test, TestResult, UserAnswer, Answer
+from summaries import record_attempts
+
+SWEEP_BATCH = int(os.getenv("SWEEP_BATCH", 500))
+SWEEP_GRACE_SECONDS = int(os.getenv("SWEEP_GRACE_SECONDS", 60))
+SWEEPER_INTERVAL = float(os.getenv("SWEEPER_INTERVAL", 0))
+
+
+def _expired_condition(db, now):
+    """
+    Условие «время вышло» без арифметики дат в SQL (она разная в Postgres и SQLite):
+    по одной границе started_at на каждое значение лимита.
+    """
+    by_limit = {}
+    for test_id, limit in db.execute(
+        select(Test.id, Test.time_limit).where(Test.time_limit > 0)
+    ).all():
+        by_limit.setdefault(limit, []).append(test_id)
+    if not by_limit:
+        return None
+    grace = datetime.timedelta(seconds=SWEEP_GRACE_SECONDS)
+    return or_(*(
+        and_(TestResult.test_id.in_(ids),
+             TestResult.started_at < now - datetime.timedelta(minutes=limit) - grace)
+        for limit, ids in by_limit.items()
+    ))
+
+
+def sweep_batch(db, now=None) -> int:
+    """Закрывает одну пачку просроченных попыток. Коммит — на вызывающей стороне. Возвращает число закрытых."""
+    now = now or datetime.datetime.utcnow()
+    expired = _expired_condition(db, now)
+    if expired is None:
+        return 0
+
+    rows = db.execute(
+        select(TestResult.id, TestResult.user_id, TestResult.test_id, TestResult.started_at, Test.time_limit)
+        .join(Test, Test.id == TestResult.test_id)
+        .where(TestResult.passed_at.is_(None), expired)
+        .order_by(TestResult.id)
+        .limit(SWEEP_BATCH)
+        .with_for_update(of=TestResult, skip_locked=True)
+    ).all()
+    if not rows:
+        return 0
+
+    # балл считаем в БД по сохранённым ответам: засчитываем вариант, только если он от своего вопроса
+    score = select(func.coalesce(func.sum(Answer.score), 0.0))\
+        .select_from(UserAnswer)\
+        .join(Answer, and_(Answer.id == UserAnswer.answer_id, Answer.question_id == UserAnswer.question_id))\
+        .where(UserAnswer.result_id == TestResult.id)\
+        .scalar_subquery()
+    # executemany одного UPDATE (Core-уровень: ORM трактовал бы список как bulk update по PK)
+    db.connection().execute(
+        update(TestResult)
+        .where(TestResult.id == bindparam('b_id'), TestResult.passed_at.is_(None))
+        .values(score=score, passed_at=bindparam('b_deadline')),
+        [
+            {'b_id': r.id, 'b_deadline': r.started_at + datetime.timedelta(minutes=r.time_limit)}
+            for r in rows
+        ],
+    )
+
+    ids = [r.id for r in rows]
+    closed = db.execute(
+        select(TestResult.id, TestResult.user_id, TestResult.test_id, TestResult.score, TestResult.passed_at)
+        .where(TestResult.id.in_(ids))
+    ).all()
+    record_attempts(db, [
+        {'user_id': c.user_id, 'test_id': c.test_id, 'result_id': c.id,
+         'score': c.score or 0.0, 'passed_at': c.passed_at}
+        for c in closed
+    ])
+    for rid in ids:
+        autosave.discard(rid)
+        forget(rid)
+    return len(ids)
+
+
+def sweep(now=None) -> int:
+    """Полный проход: пачки до тех пор, пока есть что закрывать. Каждая пачка — своя транзакция."""
+    # выборы, ещё лежащие в буфере этого воркера, должны попасть в балл
+    autosave.flush()
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            n = sweep_batch(db, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        total += n
+        if n < SWEEP_BATCH:
+            return total
+
+
+def _loop(interval: float) -> None:
+    while True:
+        try:
+            closed = sweep()
+            if closed:
+                print(f"[SWEEPER] closed {closed} expired attempt(s)")
+        except Exception as e:
+            print(f"[SWEEPER] pass failed: {e}")
+        time.sleep(interval)
+
+
+_thread = None
+
+
+def start_background(interval: float = SWEEPER_INTERVAL) -> None:
+    """Фоновый поток уборки в этом процессе (идемпотентно). interval <= 0 — выключено."""
+    global _thread
+    if interval <= 0 or (_thread is not None and _thread.is_alive()):
+        return
+    _thread = threading.Thread(target=_loop, args=(interval,), name='sweeper', daemon=True)
+    _thread.start()
+
+
+if __name__ == '__main__':
+    if '--loop' in sys.argv:
+        _loop(SWEEPER_INTERVAL or 60)
+    else:
+        print(f"[SWEEPER] closed {sweep()} expired attempt(s)")
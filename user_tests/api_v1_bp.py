@@ -0,0 +1,284 @@
+"""
+JSON API попытки для тонких клиентов (киоски, мобильные): /api/v1.
+
+Та же логика, что у HTML-версии (user_tests/attempt_flow.py), но без
+страниц и редиректов: каждый шаг — один запрос и один компактный ответ.
+Вход — обычная cookie-сессия (POST /api/v1/login), как у сайта.
+
+    POST /login                  {"username", "password"} -> {"uid", "fio"}
+    GET  /tests                  -> {"t": [{"id", "t", "tl", "n", "v"}]}           ETag
+    POST /tests/<id>/attempt     открыть/продолжить -> {"r", "tl", "rem", "s", "p"}
+    GET  /tests/<id>/paper       билет открытой попытки -> {"r", "v", "q"}         ETag
+    POST /tests/<id>/answers     автосохранение {"a": [[qid, aid], ...]} -> {"n"}
+    POST /tests/<id>/submit      {"a": [[qid, aid], ...]} -> {"st", "r", "sc"}
+    GET  /results/<rid>          -> {"r", "tid", "sc", "max", "t0", "t1", "a"}     ETag
+
+Ключи: t — название (в списке тестов), tl — лимит в секундах, n — вопросов
+в билете, v — версия теста, r — id попытки, rem — осталось секунд,
+s — сохранённые выборы [[qid, aid], ...], p — билет (как ответ /paper),
+q — вопросы [{"id", "t", "a": [[aid, текст], ...]}], st — исход отправки,
+sc — балл, t0/t1 — начало/конец (ISO, UTC), a в результате — [[qid, aid, верно 0/1]].
+Ошибки — {"e": код} с HTTP-статусом.
+
+Формат: JSON без пробелов; с Accept: application/msgpack — MessagePack
+(если установлен: pip install -r requirements-msgpack.txt). Тело запроса —
+JSON или MessagePack по Content-Type; у POST он обязателен (даже с пустым
+телом), иначе 415: HTML-форма чужого сайта не может прислать такой запрос
+без CORS-предзапроса, и это защищает cookie-сессию от CSRF.
+Билет и результат отдаются с ETag: перезапуск киоска посреди попытки — это 304 без тела.
+"""
+import json
+
+from flask import Blueprint, Response, request, session
+from sqlalchemy import select, update
+
+import archive
+import http_cache
+from db import get_db, release_db
+from models import Test, TestResult, UserAnswer, Answer, User
+from papers import get_compiled_test, catalog_versions
+from attempts import load_paper, render_questions
+from passwords import verify_password, HashQueueFull, HASH_WAIT
+from user_tests import attempt_flow as flow
+
+try:
+    import msgpack
+except ImportError:  # необязательная зависимость
+    msgpack = None
+
+MSGPACK = 'application/msgpack'
+
+api_v1_bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+# исход submit_attempt -> HTTP-статус
+_SUBMIT_STATUS = {
+    flow.NOT_FOUND: 404,
+    flow.NO_ATTEMPT: 409,
+    flow.ALREADY_CLOSED: 409,
+    flow.EMPTY: 422,
+    flow.EXPIRED_EMPTY: 200,
+    flow.GRADED: 200,
+}
+
+
+# ---------- формат ----------
+
+def _wants_msgpack() -> bool:
+    return msgpack is not None and request.accept_mimetypes.best_match(['application/json', MSGPACK]) == MSGPACK
+
+
+def reply(data, status: int = 200) -> Response:
+    if _wants_msgpack():
+        body, mimetype = msgpack.packb(data, use_bin_type=True), MSGPACK
+    else:
+        body, mimetype = json.dumps(data, ensure_ascii=False, separators=(',', ':')), 'application/json'
+    response = Response(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def error(code: str, status: int) -> Response:
+    return reply({'e': code}, status)
+
+
+def _body_types() -> tuple:
+    return ('application/json', MSGPACK) if msgpack is not None else ('application/json',)
+
+
+def _payload() -> dict:
+    """Тело запроса; Content-Type уже проверен в _check_request."""
+    if request.mimetype == MSGPACK:
+        try:
+            data = msgpack.unpackb(request.get_data(), raw=False, strict_map_key=False)
+        except (ValueError, TypeError):  # ошибки формата MessagePack — подклассы ValueError
+            data = None
+    else:
+        data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+
+def _pairs(raw) -> dict:
+    """[[qid, aid], ...] (или {qid: aid}) -> {qid: aid}; мусор отбрасываем."""
+    items = raw.items() if isinstance(raw, dict) else (raw or ())
+    choices = {}
+    for item in items:
+        try:
+            qid, aid = item
+            choices[int(qid)] = int(aid)
+        except (TypeError, ValueError):
+            continue
+    return choices
+
+
+def _iso(dt):
+    return dt.isoformat(timespec='seconds') if dt else None
+
+
+def _paper_body(result_id: int, version: int, questions) -> dict:
+    return {
+        'r': result_id,
+        'v': version,
+        'q': [{'id': q.id, 't': q.text, 'a': [[a.id, a.text] for a in q.answers]} for q in questions],
+    }
+
+
+@api_v1_bp.before_request
+def _check_request():
+    if request.method == 'POST' and request.mimetype not in _body_types():
+        return error('unsupported_media_type', 415)
+    if request.endpoint != 'api_v1.login' and 'user_id' not in session:
+        return error('unauthorized', 401)
+
+
+# ---------- вход ----------
+
+@api_v1_bp.route('/login', methods=['POST'])
+def login():
+    data = _payload()
+    username, password = str(data.get('username') or ''), str(data.get('password') or '')
+    db = get_db()
+    user = db.query(User.id, User.password, User.is_admin, User.fio).filter_by(username=username).first()
+    release_db()  # соединение не держим, пока считается хэш
+    try:
+        ok, new_hash = verify_password(user.password, password) if user else (False, None)
+    except HashQueueFull:
+        response = error('busy', 503)
+        response.headers['Retry-After'] = str(max(1, int(HASH_WAIT)))
+        return response
+    if not ok:
+        return error('bad_credentials', 401)
+    if new_hash:
+        db = get_db()
+        db.execute(update(User).where(User.id == user.id).values(password=new_hash))
+        db.commit()
+    session['user_id'] = user.id
+    session['is_admin'] = user.is_admin
+    session['fio'] = user.fio
+    return reply({'uid': user.id, 'fio': user.fio})
+
+
+# ---------- тесты и попытка ----------
+
+@api_v1_bp.route('/tests')
+def list_tests():
+    db = get_db()
+    catalog = catalog_versions(db)
+    etag = http_cache.make_etag('api_v1.list_tests', catalog, _wants_msgpack())
+    cached = http_cache.not_modified(etag)
+    if cached:
+        return cached
+    rows = db.execute(
+        select(Test.id, Test.title, Test.time_limit, Test.questions_per_attempt, Test.version).order_by(Test.id)
+    ).all()
+    return http_cache.with_validators(reply({'t': [
+        {'id': r.id, 't': r.title, 'tl': r.time_limit * 60 if r.time_limit else None,
+         'n': r.questions_per_attempt, 'v': r.version}
+        for r in rows
+    ]}), etag)
+
+
+@api_v1_bp.route('/tests/<int:test_id>/attempt', methods=['POST'])
+def start_attempt(test_id: int):
+    """Открыть или продолжить попытку; билет — сразу в ответе (?paper=0 — без него)."""
+    db = get_db()
+    opened = flow.open_attempt(db, session['user_id'], test_id)
+    if not opened.test:
+        return error('not_found', 404)
+    if opened.questions is None:
+        return error('no_questions', 409)
+    body = {
+        'r': opened.result_id,
+        'tl': opened.time_limit,
+        'rem': opened.remaining_seconds,
+        's': sorted([qid, aid] for qid, aid in opened.selected.items()),
+    }
+    if request.args.get('paper') != '0':
+        body['p'] = _paper_body(opened.result_id, opened.test.version, opened.questions)
+    return reply(body)
+
+
+@api_v1_bp.route('/tests/<int:test_id>/paper')
+def paper(test_id: int):
+    """Билет открытой попытки. Не меняется до конца попытки (кроме правки банка — новая версия)."""
+    db = get_db()
+    compiled = get_compiled_test(db, test_id)
+    if not compiled:
+        return error('not_found', 404)
+    result_id = db.execute(
+        select(TestResult.id).where(TestResult.user_id == session['user_id'],
+                                   TestResult.test_id == test_id, TestResult.passed_at.is_(None))
+    ).scalar()
+    stored = load_paper(db, result_id) if result_id else None
+    if stored is None:
+        return error('no_attempt', 409)
+    etag = http_cache.make_etag('api_v1.paper', result_id, compiled.version, _wants_msgpack())
+    cached = http_cache.not_modified(etag)
+    if cached:
+        return cached
+    body = _paper_body(result_id, compiled.version, render_questions(compiled, stored))
+    return http_cache.with_validators(reply(body), etag)
+
+
+@api_v1_bp.route('/tests/<int:test_id>/answers', methods=['POST'])
+def autosave_answers(test_id: int):
+    status, accepted = flow.autosave_choices(get_db(), session['user_id'], test_id, _pairs(_payload().get('a')))
+    if status != flow.AUTOSAVED:
+        return error(status, 409)
+    return reply({'n': accepted}, 202)
+
+
+@api_v1_bp.route('/tests/<int:test_id>/submit', methods=['POST'])
+def submit(test_id: int):
+    # submit_attempt читает выборы как поля формы question_<qid>
+    form = {f'question_{qid}': aid for qid, aid in _pairs(_payload().get('a')).items()}
+    outcome = flow.submit_attempt(get_db(), session['user_id'], test_id, form)
+    return reply({'st': outcome.status, 'r': outcome.result_id, 'sc': outcome.score},
+                 _SUBMIT_STATUS.get(outcome.status, 200))
+
+
+# ---------- результат ----------
+
+@api_v1_bp.route('/results/<int:result_id>')
+def result(result_id: int):
+    db = get_db()
+    res = db.execute(
+        select(TestResult.id, TestResult.test_id, TestResult.score, TestResult.started_at,
+               TestResult.passed_at, TestResult.archived_at, Test.max_score, Test.version)
+        .join(Test, Test.id == TestResult.test_id)
+        .where(TestResult.id == result_id, TestResult.user_id == session['user_id'])
+    ).first()
+    if not res:
+        return error('not_found', 404)
+
+    # max берётся из текущей версии теста: после правки банка прежний ответ устарел
+    etag = http_cache.make_etag('api_v1.result', res.id, res.passed_at, res.score,
+                                res.version, res.max_score, _wants_msgpack())
+    if res.passed_at:
+        cached = http_cache.not_modified(etag, res.passed_at)
+        if cached:
+            return cached
+
+    if res.archived_at:
+        answers = [[a.question_id, a.answer_id, int(a.is_correct)] for a in archive.load_answers(db, res.id)]
+    else:
+        answers = [
+            [qid, aid, int(bool(correct))]
+            for qid, aid, correct in db.execute(
+                select(UserAnswer.question_id, UserAnswer.answer_id, Answer.is_correct)
+                .join(Answer, Answer.id == UserAnswer.answer_id)
+                .where(UserAnswer.result_id == res.id)
+                .order_by(UserAnswer.id)
+            ).all()
+        ]
+    response = reply({
+        'r': res.id,
+        'tid': res.test_id,
+        'sc': res.score,
+        'max': res.max_score,
+        't0': _iso(res.started_at),
+        't1': _iso(res.passed_at),
+        'a': answers,
+    })
+    if not res.passed_at:
+        return response
+    return http_cache.with_validators(response, etag, res.passed_at)
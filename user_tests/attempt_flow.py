@@ -0,0 +1,239 @@
+"""
+Логика попытки без привязки к веб-фреймворку.
+
+Функции принимают обычную (синхронную) сессию и возвращают результат,
+а flash/redirect/render остаются во вьюхах. Так одну и ту же логику
+вызывают и Flask-блюпринт (user_tests_bp), и асинхронный режим (asgi.py)
+через AsyncSession.run_sync.
+"""
+import datetime
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import autosave
+import sampling
+from models import Test, TestResult
+from attempts import load_paper, new_paper, save_paper, forget, question_ids, render_questions
+from papers import get_compiled_test
+from summaries import record_attempt
+from user_tests.grading import load_saved, collect_choices, merge_choices, grade, save_graded, close_result
+
+# исходы submit_attempt
+NOT_FOUND = 'not_found'
+NO_ATTEMPT = 'no_attempt'
+ALREADY_CLOSED = 'already_closed'
+EMPTY = 'empty'
+EXPIRED_EMPTY = 'expired_empty'
+GRADED = 'graded'
+# исходы autosave_choices (плюс NO_ATTEMPT)
+AUTOSAVED = 'autosaved'
+EXPIRED = 'expired'
+
+# автосохранение принимаем чуть дольше лимита: сеть и таймер браузера неточны
+AUTOSAVE_GRACE_SECONDS = 30
+
+
+@dataclass
+class OpenedAttempt:
+    test: object                 # CompiledTest или None, если теста нет
+    questions: list = None       # None — в тесте нет вопросов
+    time_limit: int = None       # секунды
+    remaining_seconds: int = None
+    selected: dict = None        # автосохранённые выборы {question_id: answer_id}
+    result_id: int = None
+
+
+@dataclass
+class Submission:
+    status: str
+    result_id: int = None
+    score: float = None
+
+
+def pop_legacy_selected(session) -> dict:
+    """
+    Раньше билет лежал в cookie под selected_questions_{res_id}.
+    Вычищаем такие ключи (в т.ч. от брошенных попыток) и возвращаем {res_id: [question_id, ...]}.
+    """
+    legacy = {}
+    for key in [k for k in session if k.startswith('selected_questions_')]:
+        value = session.pop(key)
+        try:
+            legacy[int(key.rsplit('_', 1)[1])] = value
+        except ValueError:
+            pass
+    return legacy
+
+
+def _open_result(db, user_id: int, test_id: int):
+    return db.query(TestResult).filter_by(
+        user_id=user_id, test_id=test_id, passed_at=None
+    ).first()
+
+
+def open_attempt(db, user_id: int, test_id: int, legacy=None) -> OpenedAttempt:
+    """
+    Открывает (или продолжает) попытку и собирает её билет.
+    legacy — {result_id: [question_id, ...]} из старых cookie, если были.
+    """
+    # билет из кэша воркера: при неизменной версии — один узкий запрос
+    test = get_compiled_test(db, test_id)
+    if not test:
+        return OpenedAttempt(test=None)
+
+    res = _open_result(db, user_id, test_id)
+    # билет попытки хранится на сервере (attempt_states + кэш воркера)
+    paper = load_paper(db, res.id) if res else None
+    selected = {}
+    if paper is not None:
+        # продолжение попытки: подставляем то, что уже успели выбрать
+        selected = {**load_saved(db, res.id), **autosave.pending_for(res.id)}
+    else:
+        if not test.question_ids:
+            return OpenedAttempt(test=test)
+        if not res:
+            res = TestResult(
+                user_id=user_id,
+                test_id=test_id,
+                started_at=datetime.datetime.utcnow()
+            )
+            db.add(res)
+            db.flush()
+        # попытки, начатые до переезда билета на сервер, досдаём по старому списку из cookie
+        legacy_ids = (legacy or {}).get(res.id)
+        # билет целиком определяется зерном попытки (см. sampling.py)
+        seed = sampling.new_seed()
+        paper = new_paper(test, seed, legacy_ids or None)
+        save_paper(db, res.id, paper, None if legacy_ids else seed, test.version)
+        try:
+            db.commit()
+        except IntegrityError:
+            # параллельный GET (двойной клик) уже сохранил билет — берём его
+            db.rollback()
+            forget(res.id)
+            paper = load_paper(db, res.id) or ()
+
+    # ВАЖНО: считаем оставшиеся секунды на сервере
+    time_limit_sec = test.time_limit * 60 if test.time_limit else None
+    remaining_seconds = None
+    if time_limit_sec:
+        elapsed = int((datetime.datetime.utcnow() - res.started_at).total_seconds())
+        remaining_seconds = max(0, time_limit_sec - elapsed)
+
+    return OpenedAttempt(
+        test=test,
+        questions=render_questions(test, paper),
+        time_limit=time_limit_sec,
+        remaining_seconds=remaining_seconds,
+        selected=selected,
+        result_id=res.id,
+    )
+
+
+def _closed_meanwhile(db, result_id: int) -> Submission:
+    # попытку закрыли между чтением и записью (уборщик, двойная отправка):
+    # её результат и сводку уже записал тот, кто закрыл, — второй раз не считаем
+    db.rollback()
+    forget(result_id)
+    return Submission(ALREADY_CLOSED, result_id)
+
+
+def submit_attempt(db, user_id: int, test_id: int, form) -> Submission:
+    """Проверяет и закрывает открытую попытку. form — любой mapping с .get()."""
+    test = get_compiled_test(db, test_id)
+    if not test:
+        return Submission(NOT_FOUND)
+
+    res = _open_result(db, user_id, test_id)
+    if not res:
+        return Submission(NO_ATTEMPT)
+    if res.passed_at:
+        return Submission(ALREADY_CLOSED, res.id)
+
+    # билет берём с сервера: cookie больше не участвует
+    selected_ids = question_ids(load_paper(db, res.id) or ())
+
+    # проверяем, истёк ли лимит
+    expired = False
+    if test.time_limit:
+        elapsed_min = (datetime.datetime.utcnow() - res.started_at).total_seconds() / 60
+        expired = elapsed_min >= test.time_limit
+
+    # ответы: автосохранённые в БД → ещё не сброшенные в этом воркере → форма
+    saved = load_saved(db, res.id)
+    pending = autosave.discard(res.id)
+    choices = merge_choices(selected_ids, saved, pending, collect_choices(form, selected_ids))
+
+    # если нет ни одного ответа:
+    if not choices:
+        if not expired:
+            return Submission(EMPTY, res.id)
+        # корректно завершаем попытку с нулём, чтобы не было бесконечного цикла
+        passed_at = close_result(db, res.id, 0.0)
+        if passed_at is None:
+            return _closed_meanwhile(db, res.id)
+        record_attempt(db, user_id, test_id, res.id, 0.0, passed_at)
+        db.commit()
+        forget(res.id)
+        return Submission(EXPIRED_EMPTY, res.id, 0.0)
+
+    # проверка в памяти по ключу из кэша; пишется только разница с сохранённым
+    score, accepted = grade(test.answer_key, choices)
+    passed_at = save_graded(db, res.id, score, accepted, saved)
+    if passed_at is None:
+        return _closed_meanwhile(db, res.id)
+    record_attempt(db, user_id, test_id, res.id, score, passed_at)
+    db.commit()
+    forget(res.id)
+    return Submission(GRADED, res.id, score)
+
+
+def autosave_choices(db, user_id: int, test_id: int, raw: dict):
+    """
+    Принимает выборы {question_id: answer_id} (ключи/значения могут быть строками)
+    для открытой попытки и кладёт их в буфер автосохранения.
+    Возвращает (статус, число принятых): (AUTOSAVED | NO_ATTEMPT | EXPIRED, n).
+    Варианты, которых нет в билете этой попытки, молча отбрасываются.
+    """
+    row = db.execute(
+        select(TestResult.id, TestResult.started_at, Test.time_limit)
+        .join(Test, Test.id == TestResult.test_id)
+        .where(TestResult.user_id == user_id, TestResult.test_id == test_id, TestResult.passed_at.is_(None))
+    ).first()
+    if row is None:
+        return NO_ATTEMPT, 0
+    if row.time_limit:
+        deadline = row.started_at + datetime.timedelta(minutes=row.time_limit, seconds=AUTOSAVE_GRACE_SECONDS)
+        if datetime.datetime.utcnow() > deadline:
+            return EXPIRED, 0
+
+    options = dict(load_paper(db, row.id) or ())
+    choices = {}
+    for qid, aid in (raw or {}).items():
+        try:
+            qid, aid = int(qid), int(aid)
+        except (TypeError, ValueError):
+            continue
+        if aid in options.get(qid, ()):
+            choices[qid] = aid
+    autosave.buffer(row.id, choices)
+    return AUTOSAVED, len(choices)
+
+
+def submission_redirect(outcome: Submission, test_id: int):
+    """Исход submit_attempt -> ((сообщение, категория), (эндпоинт, параметры url_for))."""
+    if outcome.status == NOT_FOUND:
+        return ('Тест не найден', 'error'), ('user_tests.list_tests', {})
+    if outcome.status == NO_ATTEMPT:
+        return ('Не найдена начатая попытка', 'error'), ('user_tests.ready_test', {'test_id': test_id})
+    if outcome.status == ALREADY_CLOSED:
+        return ('Тест уже завершён', 'warning'), ('user_tests.view_result', {'result_id': outcome.result_id})
+    if outcome.status == EMPTY:
+        return ('Вы не выбрали ни одного ответа!', 'error'), ('user_tests.start_test', {'test_id': test_id})
+    if outcome.status == EXPIRED_EMPTY:
+        return ('Время вышло. Попытка завершена.', 'warning'), \
+            ('user_tests.view_result', {'result_id': outcome.result_id})
+    return (f'Тест завершён! Ваш результат: {outcome.score:.1f} балл(ов).', 'success'), \
+        ('user_tests.view_result', {'result_id': outcome.result_id})
@@ -0,0 +1,122 @@
+"""
+Проверка попытки за фиксированное число запросов.
+
+Ключ ответов по всем вопросам попытки грузится одним запросом,
+баллы считаются в памяти, а UserAnswer и итог TestResult пишутся
+пакетно в одной транзакции — независимо от количества вопросов.
+
+Ответы, уже сохранённые автосохранением, не переписываются:
+при отправке пишется только разница с формой.
+"""
+import datetime
+
+from sqlalchemy import select, delete, update
+
+from db import upsert_insert
+from models import Answer, TestResult, UserAnswer
+
+
+def load_answer_key(db, question_ids) -> dict:
+    """{answer_id: (question_id, score)} для всех вариантов выбранных вопросов — один запрос."""
+    if not question_ids:
+        return {}
+    rows = db.execute(
+        select(Answer.id, Answer.question_id, Answer.score)
+        .where(Answer.question_id.in_(question_ids))
+    ).all()
+    return {aid: (qid, score or 0.0) for aid, qid, score in rows}
+
+
+def load_saved(db, result_id: int) -> dict:
+    """Уже сохранённые ответы попытки {question_id: answer_id} — один запрос."""
+    return dict(db.execute(
+        select(UserAnswer.question_id, UserAnswer.answer_id).where(UserAnswer.result_id == result_id)
+    ).all())
+
+
+def collect_choices(form, question_ids) -> dict:
+    """Выбранные варианты из формы: {question_id: answer_id}. Мусор и пустые поля пропускаем."""
+    choices = {}
+    for qid in question_ids:
+        raw = form.get(f'question_{qid}')
+        if not raw:
+            continue
+        try:
+            choices[qid] = int(raw)
+        except (TypeError, ValueError):
+            continue
+    return choices
+
+
+def grade(answer_key: dict, choices: dict):
+    """
+    Считает баллы в памяти.
+    Засчитываем только те ответы, что действительно принадлежат своему вопросу.
+    Возвращает (score, [(question_id, answer_id), ...]).
+    """
+    score = 0.0
+    accepted = []
+    for qid, aid in choices.items():
+        key = answer_key.get(aid)
+        if key is None or key[0] != qid:
+            continue
+        score += key[1]
+        accepted.append((qid, aid))
+    return score, accepted
+
+
+def merge_choices(question_ids, *layers) -> dict:
+    """Сливает выборы (сохранённые → буфер автосохранения → форма), позже — главнее. Только вопросы билета."""
+    allowed = set(question_ids)
+    merged = {}
+    for layer in layers:
+        if layer:
+            merged.update((qid, aid) for qid, aid in layer.items() if qid in allowed)
+    return merged
+
+
+def close_result(db, result_id: int, score: float):
+    """
+    Закрывает попытку, только если она ещё открыта (passed_at IS NULL).
+    Возвращает passed_at или None — попытку уже закрыли (уборщик, повторная
+    отправка). На Postgres UPDATE берёт блокировку строки: параллельный
+    закрывающий ждёт коммита и затем не находит открытой попытки.
+    """
+    passed_at = datetime.datetime.utcnow()
+    closed = db.execute(
+        update(TestResult)
+        .where(TestResult.id == result_id, TestResult.passed_at.is_(None))
+        .values(score=score, passed_at=passed_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return passed_at if closed else None
+
+
+def save_graded(db, result_id: int, score: float, accepted, saved=None):
+    """
+    Пакетная запись результата: сначала закрытие попытки (close_result),
+    затем upsert изменившихся ответов и delete лишних (не засчитанных).
+    Возвращает passed_at или None, если попытку уже закрыли — тогда ответы
+    не трогаем. Коммит (или откат) — на вызывающей стороне.
+    """
+    saved = saved or {}
+    passed_at = close_result(db, result_id, score)
+    if passed_at is None:
+        return None
+    accepted = dict(accepted)
+    stale = [qid for qid in saved if qid not in accepted]
+    if stale:
+        db.execute(delete(UserAnswer).where(
+            UserAnswer.result_id == result_id, UserAnswer.question_id.in_(stale)
+        ))
+    changed = [
+        {'result_id': result_id, 'question_id': qid, 'answer_id': aid}
+        for qid, aid in accepted.items() if saved.get(qid) != aid
+    ]
+    if changed:
+        stmt = upsert_insert(db, UserAnswer)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[UserAnswer.result_id, UserAnswer.question_id],
+            set_={'answer_id': stmt.excluded.answer_id},
+        ), changed)
+    return passed_at